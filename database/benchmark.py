@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+
+import getpass
+import json
+import random
+import resource
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from lxml import etree
+from multiprocessing import get_context
+from os import getpid
+from os import listdir
+from os import path
+from os import remove
+from os import stat
+from tempfile import TemporaryDirectory
+from threading import Lock
+from threading import Thread
+from time import monotonic
+from time import perf_counter
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from data import xml as XML
+from data.util import open_file
+
+WORDS = ('acute', 'lymphoblastic', 'leukemia', 'cells', 'treated', 'with', 'dexamethasone', 'bone', 'marrow',
+         'mouse', 'model', 'RNA', 'sequencing', 'of', 'tumor', 'samples', 'from', 'patients', 'relapse', 'liver')
+TISSUES = ('liver', 'brain', 'bone marrow', 'blood', 'spleen', 'lymph node')
+
+
+def generate_experiment_package_set(file_name: str, packages: int, seed: int = 42):
+    """Write a synthetic EXPERIMENT_PACKAGE_SET with the shape of SRA EFetch documents."""
+    generator = random.Random(seed)
+
+    def sentence(size):
+        return ' '.join(generator.choice(WORDS) for _ in range(size))
+
+    with open_file(file_name, 'wb') as file, etree.xmlfile(file, encoding='utf-8') as output:
+        output.write_declaration()
+        with output.element('EXPERIMENT_PACKAGE_SET'):
+            for i in range(1, packages + 1):
+                package = etree.Element('EXPERIMENT_PACKAGE')
+                experiment = etree.SubElement(package, 'EXPERIMENT', accession=f'SRX{i}', alias=f'experiment {i}')
+                etree.SubElement(etree.SubElement(experiment, 'IDENTIFIERS'), 'PRIMARY_ID').text = f'SRX{i}'
+                etree.SubElement(experiment, 'TITLE').text = sentence(8)
+                etree.SubElement(experiment, 'STUDY_REF', accession=f'SRP{i % 100}')
+                design = etree.SubElement(experiment, 'DESIGN')
+                etree.SubElement(design, 'DESIGN_DESCRIPTION').text = sentence(30)
+                library = etree.SubElement(design, 'LIBRARY_DESCRIPTOR')
+                etree.SubElement(library, 'LIBRARY_STRATEGY').text = generator.choice(('RNA-Seq', 'WGS', 'AMPLICON'))
+                etree.SubElement(etree.SubElement(library, 'LIBRARY_LAYOUT'), generator.choice(('PAIRED', 'SINGLE')))
+                etree.SubElement(package, 'SUBMISSION', accession=f'SRA{i}', center_name='LAB')
+                study = etree.SubElement(package, 'STUDY', accession=f'SRP{i % 100}')
+                descriptor = etree.SubElement(study, 'DESCRIPTOR')
+                etree.SubElement(descriptor, 'STUDY_TITLE').text = sentence(10)
+                etree.SubElement(descriptor, 'STUDY_ABSTRACT').text = sentence(120)
+                if i % 3 == 0:
+                    link = etree.SubElement(etree.SubElement(etree.SubElement(study, 'STUDY_LINKS'), 'STUDY_LINK'),
+                                            'XREF_LINK')
+                    etree.SubElement(link, 'DB').text = 'pubmed'
+                    etree.SubElement(link, 'ID').text = str(30000000 + i % 500)
+                sample = etree.SubElement(package, 'SAMPLE', accession=f'SRS{i}')
+                etree.SubElement(sample, 'TITLE').text = sentence(6)
+                attributes = etree.SubElement(sample, 'SAMPLE_ATTRIBUTES')
+                for tag, value in (('tissue', generator.choice(TISSUES)), ('age', str(generator.randint(1, 90))),
+                                   ('treatment', generator.choice(('dexamethasone', 'none', 'vincristine 2 mg'))),
+                                   ('description', sentence(20))):
+                    attribute = etree.SubElement(attributes, 'SAMPLE_ATTRIBUTE')
+                    etree.SubElement(attribute, 'TAG').text = tag
+                    etree.SubElement(attribute, 'VALUE').text = value
+                run_set = etree.SubElement(package, 'RUN_SET')
+                for j in range(generator.randint(1, 3)):
+                    run = etree.SubElement(run_set, 'RUN', accession=f'SRR{i}{j}',
+                                           total_spots=str(generator.randint(1, 10 ** 7)))
+                    etree.SubElement(etree.SubElement(run, 'IDENTIFIERS'), 'PRIMARY_ID').text = f'SRR{i}{j}'
+                output.write(package)
+
+
+class EUtilitiesHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the E-utilities used by SRA: ESearch, EFetch and ELink, without PubMed links. Each request
+    is recorded by the server with its arrival time, and EFetch fails for the IDs in server.failing_ids."""
+    def log_message(self, *arguments):
+        pass
+
+    def do_GET(self):
+        self.__answer(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        self.__answer({**parse_qs(urlparse(self.path).query), **parse_qs(body)})
+
+    def __answer(self, parameters):
+        parameters = {key: values[0] for key, values in parameters.items()}
+        service = path.basename(urlparse(self.path).path)
+        with self.server.lock:
+            self.server.requests.append((monotonic(), service, parameters))
+        ids = [str(uid) for uid in range(1, self.server.records + 1)]
+        if service == 'esearch.fcgi':
+            start, size = int(parameters.get('RetStart', 0)), int(parameters.get('RetMax', 20))
+            body = f'<eSearchResult><Count>{len(ids)}</Count><IdList>' \
+                   f'{"".join(f"<Id>{uid}</Id>" for uid in ids[start:start + size])}</IdList></eSearchResult>'
+        elif service == 'efetch.fcgi' and parameters.get('db') == 'sra':
+            requested = parameters['id'].split(',')
+            if self.server.failing_ids & set(requested):
+                self.send_response(500)
+                self.end_headers()
+                return
+            packages = ''.join(f'<EXPERIMENT_PACKAGE><EXPERIMENT accession="SRX{uid}"/></EXPERIMENT_PACKAGE>'
+                               for uid in requested)
+            body = f'<EXPERIMENT_PACKAGE_SET>{packages}</EXPERIMENT_PACKAGE_SET>'
+        elif service == 'elink.fcgi':
+            body = '<eLinkResult><LinkSet><DbFrom>sra</DbFrom></LinkSet></eLinkResult>'
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_eutilities(records: int):
+    """Serve EUtilitiesHandler on a free local port, in a daemon thread, with the given number of records."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EUtilitiesHandler)
+    server.records = records
+    server.failing_ids = set()
+    server.requests = []
+    server.lock = Lock()
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def benchmark_compression(packages: int, work_directory: str):
+    """Compare size, write time and parse time of plain, gzip and zstandard XML files."""
+    extensions = ['', '.gz']
+    try:
+        import zstandard
+        extensions.append('.zst')
+    except ImportError:
+        print('zstandard is not installed, skipping .zst files.')
+    print(f'{"file":<20} {"size (MB)":>10} {"ratio":>7} {"write (s)":>10} {"parse (s)":>10}')
+    plain_size = None
+    for extension in extensions:
+        file_name = path.join(work_directory, f'database.xml{extension}')
+        start = perf_counter()
+        generate_experiment_package_set(file_name, packages)
+        write_time = perf_counter() - start
+        size = stat(file_name).st_size
+        if plain_size is None:
+            plain_size = size
+        start = perf_counter()
+        with open_file(file_name) as file:
+            etree.parse(file, etree.XMLParser(remove_blank_text=True, remove_comments=True))
+        parse_time = perf_counter() - start
+        print(f'{path.basename(file_name):<20} {size / 1024 / 1024:>10.2f} {plain_size / size:>7.1f} '
+              f'{write_time:>10.2f} {parse_time:>10.2f}')
+
+
+def infer_structure(file_name: str, streaming: bool):
+    """Infer the structure of a XML file, returning the number of tables, elapsed time and peak memory (MB)."""
+    # paths has one entry by record, so it is not kept.
+    entities, references, paths, counts = {}, {}, None, Counter()
+    start = perf_counter()
+    with open_file(file_name) as file:
+        if streaming:
+            XML.generate_structure_from_file(file, entities, references, paths, start_node='EXPERIMENT_PACKAGE',
+                                             counts=counts)
+        else:
+            data = etree.parse(file, etree.XMLParser(remove_blank_text=True, remove_comments=True))
+            XML.generate_structure(data.getroot(), entities, references, paths, start_node='EXPERIMENT_PACKAGE',
+                                   counts=counts)
+    return len(entities), perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_structure(packages: int, work_directory: str, in_memory: bool = True):
+    """Compare structure inference streaming the file with iterparse and parsing the whole document."""
+    file_name = path.join(work_directory, 'database.xml')
+    generate_experiment_package_set(file_name, packages)
+    print(f'{path.basename(file_name)}: {packages} packages, {stat(file_name).st_size / 1024 / 1024:.2f} MB')
+    print(f'{"method":<12} {"tables":>7} {"time (s)":>10} {"peak memory (MB)":>17}')
+    methods = [('iterparse', True)] + ([('parse', False)] if in_memory else [])
+    for method, streaming in methods:
+        # each method runs in a new process, so the peak memory of one does not hide the other.
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            tables, elapsed, memory = executor.submit(infer_structure, file_name, streaming).result()
+        print(f'{method:<12} {tables:>7} {elapsed:>10.2f} {memory:>17.1f}')
+
+
+def benchmark_ingest(packages: int, baseline_packages: int, work_directory: str, connection: dict,
+                     workers: list = None):
+    """Compare rows by second inserted one row by transaction (the previous behavior) and with COPY batches, by
+    number of worker processes.
+
+    Each run creates a new database, which is dropped at the end."""
+    import psycopg2
+    from data.database import Database
+    print(f'{"method":<12} {"workers":>7} {"packages":>9} {"rows":>9} {"time (s)":>10} {"rows/s":>10}')
+    runs = [('row by row', baseline_packages, 1, 1)]
+    runs.extend(('COPY', packages, None, worker_count) for worker_count in (workers or [1]))
+    for method, package_count, batch_size, worker_count in runs:
+        file_name = path.join(work_directory, f'database_{package_count}.xml')
+        generate_experiment_package_set(file_name, package_count)
+        database_name = f'benchmark_ingest_{getpid()}'
+        administration = psycopg2.connect(database='postgres', **connection)
+        administration.autocommit = True
+        with administration.cursor() as cursor:
+            cursor.execute(f'CREATE DATABASE {database_name}')
+        try:
+            database = Database(database=database_name, **connection)
+            start = perf_counter()
+            rows = database.create_from_xml(file_name, batch_size=batch_size, workers=worker_count)
+            elapsed = perf_counter() - start
+            del database
+            Database.close_pools()
+            print(f'{method:<12} {worker_count:>7} {package_count:>9} {rows:>9} {elapsed:>10.2f} '
+                  f'{rows / elapsed:>10.0f}')
+        finally:
+            with administration.cursor() as cursor:
+                cursor.execute(f'DROP DATABASE IF EXISTS {database_name}')
+            administration.close()
+
+
+def benchmark_consolidate(packages: int, baseline_rows: int, work_directory: str, connection: dict):
+    """Compare the unpivot of the attributes of Database.add_all_to_consolidated_mesh_terms_table done with one INSERT
+    by field (the previous behavior, stopped after baseline_rows rows) and the whole method done with set-based SQL.
+    Attribute rows are the non-null fields of the tables; the method skips the ignored ones.
+
+    The database is created from synthetic packages and dropped at the end."""
+    import psycopg2
+    from data.database import Database
+    file_name = path.join(work_directory, 'database.xml')
+    generate_experiment_package_set(file_name, packages)
+    database_name = f'benchmark_consolidate_{getpid()}'
+    administration = psycopg2.connect(database='postgres', **connection)
+    administration.autocommit = True
+    with administration.cursor() as cursor:
+        cursor.execute(f'CREATE DATABASE {database_name}')
+    try:
+        database = Database(database=database_name, **connection)
+        database.create_from_xml(file_name)
+        database.create_annotation_tables()
+        database.create_ignored_fields_tables()
+        tables = database.get_tables_columns()
+        data = psycopg2.connect(database=database_name, **connection)
+        with data.cursor() as cursor:
+            # a tabela consolidada é criada por get_counts_file, que não faz parte do benchmark
+            cursor.execute('CREATE TABLE IF NOT EXISTS data_mining.consolidated_sample (accession TEXT)')
+            data.commit()
+            rows = 0
+            for table, value in tables.items():
+                columns = [column for column in value['columns'] if column != 'internal_id']
+                if len(columns) > 0:
+                    cursor.execute(f'SELECT {" + ".join(f"count({column})" for column in columns)} FROM {table}')
+                    rows += cursor.fetchone()[0]
+            print(f'{packages} packages, {rows} attribute rows')
+            print(f'{"method":<12} {"rows":>9} {"time (s)":>10} {"rows/s":>10}')
+            cursor.execute('CREATE TEMPORARY TABLE temp_table_data (schema_name TEXT, table_name TEXT, '
+                           'column_name TEXT, internal_id BIGINT, sample_accession TEXT, value TEXT)')
+            inserted = 0
+            start = perf_counter()
+            for table, value in tables.items():
+                cursor.execute(f'SELECT * FROM {value["schema"]}.{table}')
+                columns = [column.name for column in cursor.description]
+                for row in cursor.fetchall():
+                    if inserted >= baseline_rows:
+                        break
+                    record = dict(zip(columns, row))
+                    for column in columns:
+                        if column != 'internal_id' and record[column] is not None:
+                            cursor.execute('INSERT INTO temp_table_data(schema_name, table_name, column_name, '
+                                           'internal_id, sample_accession, value) VALUES (%s, %s, %s, %s, %s, %s)',
+                                           (value['schema'], table, column, record['internal_id'], None,
+                                            record[column]))
+                            inserted += 1
+                if inserted >= baseline_rows:
+                    break
+            elapsed = perf_counter() - start
+            print(f'{"row by row":<12} {inserted:>9} {elapsed:>10.2f} {inserted / elapsed:>10.0f}')
+        data.rollback()
+        data.close()
+        start = perf_counter()
+        database.add_all_to_consolidated_mesh_terms_table()
+        elapsed = perf_counter() - start
+        print(f'{"set based":<12} {rows:>9} {elapsed:>10.2f} {rows / elapsed:>10.0f}')
+        database.close()
+        del database
+    finally:
+        Database.close_pools()
+        with administration.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS {database_name}')
+        administration.close()
+
+
+def benchmark_catalog(packages: int, work_directory: str, connection: dict):
+    """Check that the schema catalog describes the consolidated tables created by Database.get_counts_file, after
+    it was loaded without them. Raises AssertionError otherwise.
+
+    The database is created from synthetic packages and dropped at the end."""
+    import psycopg2
+    from data.database import Database
+    file_name = path.join(work_directory, 'database.xml')
+    generate_experiment_package_set(file_name, packages)
+    database_name = f'benchmark_catalog_{getpid()}'
+    administration = psycopg2.connect(database='postgres', **connection)
+    administration.autocommit = True
+    with administration.cursor() as cursor:
+        cursor.execute(f'CREATE DATABASE {database_name}')
+    try:
+        with Database(database=database_name, **connection) as database:
+            database.create_from_xml(file_name)
+            database.create_annotation_tables()
+            assert 'consolidated_study' not in database.get_tables_columns(data_mining_tables=True)
+            # contagens no formato de get_counts_data: um campo combinado, com a categoria de cada accession
+            accessions = sorted(database.get_experiment_accessions())
+            results = {'experiment_package_study': {'tissue': {'tissue': {
+                'accession': accessions,
+                'others': {'tissue': {'liver': {'accession': accessions[::2]},
+                                      'brain': {'accession': accessions[1::2]}}},
+            }}}}
+            database.get_counts_file(work_directory, results=results)
+            tables = database.get_tables_columns(data_mining_tables=True)
+            assert 'consolidated_study' in tables, 'the new consolidated table is not in the catalog'
+            assert sorted(tables['consolidated_study']['columns']) == ['accession', 'tissue'], \
+                f'the catalog describes columns {tables["consolidated_study"]["columns"]}'
+        # outra instância lê o catálogo persistido em table_column
+        with Database(database=database_name, **connection) as database:
+            assert 'consolidated_study' in database.get_tables_columns(data_mining_tables=True), \
+                'the persisted catalog does not describe the new consolidated table'
+        print('Catalog checks passed.')
+    finally:
+        Database.close_pools()
+        with administration.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS {database_name}')
+        administration.close()
+
+
+def benchmark_pool(connection: dict, timeout: float = 1):
+    """Check that Database instances beyond the capacity of the connection pool (pool_max_size // 2 instances, each one
+    reserving two connections) fail after pool_timeout seconds instead of waiting forever, and that closing an
+    instance lets the next one in. Raises AssertionError otherwise."""
+    from data.database import Database
+    from psycopg2.pool import PoolError
+    print(f'{"pool_max_size":>13} {"instances":>10} {"failed after (s)":>17}')
+    try:
+        for pool_max_size in (2, 4):
+            instances = [Database(database='postgres', pool_max_size=pool_max_size, pool_timeout=timeout, **connection)
+                         for _ in range(pool_max_size // 2 + 1)]
+            # get_experiment_accessions takes the first connection of the instance
+            for database in instances[:-1]:
+                database.get_experiment_accessions()
+            start = perf_counter()
+            try:
+                instances[-1].get_experiment_accessions()
+                raise AssertionError(f'instance {len(instances)} got a connection with pool_max_size={pool_max_size}')
+            except PoolError:
+                elapsed = perf_counter() - start
+            print(f'{pool_max_size:>13} {len(instances):>10} {elapsed:>17.2f}')
+            assert elapsed < timeout + 1, f'the exhausted pool failed after {elapsed:.2f} seconds'
+            instances[0].close()
+            instances[-1].get_experiment_accessions()
+            for database in instances:
+                database.close()
+        print('Pool checks passed.')
+    finally:
+        Database.close_pools()
+
+
+def benchmark_resume(records: int, pagination: int, work_directory: str):
+    """Check that SRA.search resumes an interrupted download from its checkpoint directory: a rerun fetches only the
+    missing pages, keeping the intact ones and fetching again the corrupted ones, and a change of the records count
+    drops every page of the previous run. Raises AssertionError otherwise."""
+    from data.sra import SRA
+    server, url = start_eutilities(records)
+    checkpoint_directory = path.join(work_directory, 'pages')
+    offsets = set(range(0, records, pagination))
+
+    def harvest(failing_offset=None):
+        # a page fails after the retries of SRA.query when one of its IDs fails, interrupting the download.
+        server.failing_ids = set() if failing_offset is None else {str(failing_offset + 1)}
+        server.requests.clear()
+        start = perf_counter()
+        try:
+            SRA(url=url, api_key='benchmark', pagination=pagination).search(
+                'benchmark', database_file=None, checkpoint_directory=checkpoint_directory)
+            interrupted = False
+        except ConnectionError:
+            interrupted = True
+        fetched = {(int(parameters['id'].split(',')[0]) - 1) // pagination * pagination
+                   for _, service, parameters in server.requests if service == 'efetch.fcgi'}
+        with open(path.join(checkpoint_directory, 'manifest.json')) as file:
+            kept = {int(offset) for offset in json.load(file)['pages']}
+        print(f'{len(server.requests):>9} {len(fetched):>8} {len(kept):>5} {str(interrupted):>12} '
+              f'{perf_counter() - start:>10.2f}')
+        return fetched, kept, interrupted
+
+    def page_file(offset):
+        return path.join(checkpoint_directory, f'page_{offset:09d}.xml')
+
+    try:
+        print(f'{records} records, {len(offsets)} pages')
+        print(f'{"requests":>9} {"fetched":>8} {"kept":>5} {"interrupted":>12} {"time (s)":>10}')
+        failing_offset = sorted(offsets)[len(offsets) // 2]
+        _, kept, interrupted = harvest(failing_offset)
+        assert interrupted and failing_offset not in kept and len(kept) > 0, 'the first run was not interrupted'
+        # a page with a wrong digest and a page without file are fetched again, like the pages never fetched.
+        corrupted, removed = sorted(kept)[:2]
+        with open(page_file(corrupted), 'ab') as file:
+            file.write(b'<!-- truncated -->')
+        remove(page_file(removed))
+        missing = offsets - kept | {corrupted, removed}
+        fetched, kept, interrupted = harvest()
+        assert not interrupted and kept == offsets, 'the rerun did not complete the download'
+        assert fetched == missing, f'the rerun fetched {sorted(fetched)} instead of {sorted(missing)}'
+        # a different records count invalidates the manifest: every page is fetched and no stale page is left.
+        server.records = records - pagination
+        offsets = set(range(0, server.records, pagination))
+        fetched, kept, interrupted = harvest()
+        assert fetched == offsets and kept == offsets, 'pages of the previous count were reused'
+        pages = {name for name in listdir(checkpoint_directory) if name.startswith('page_')}
+        assert pages == {path.basename(page_file(offset)) for offset in offsets}, 'stale pages were left'
+        print('Resume checks passed.')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def benchmark_rate_limit(records: int, pagination: int):
+    """Measure the spacing of the requests sent by SRA.pages to a local E-utilities stand-in, without an API key
+    (3 requests by second) and with one (10 requests by second). Raises AssertionError when any second has more
+    requests than the limit, with 5% of tolerance for the arrival times, or when the threads do not use most of it."""
+    from data.sra import SRA
+    server, url = start_eutilities(records)
+    try:
+        print(f'{records} records, {(records + pagination - 1) // pagination} pages')
+        print(f'{"limit (req/s)":>13} {"requests":>9} {"time (s)":>10} {"req/s":>7} {"min spacing (s)":>16} '
+              f'{"max req/s":>10}')
+        for api_key, rate in ((None, 3), ('benchmark', 10)):
+            server.requests.clear()
+            for _ in SRA(url=url, api_key=api_key, pagination=pagination).pages('benchmark'):
+                pass
+            times = sorted(time for time, _, _ in server.requests)
+            elapsed = times[-1] - times[0]
+            spacing = min(second - first for first, second in zip(times, times[1:]))
+            # requests of the busiest second: rate intervals between consecutive requests take at least 1 second.
+            busiest = max(rate / (times[i + rate] - times[i]) for i in range(len(times) - rate))
+            print(f'{rate:>13} {len(times):>9} {elapsed:>10.2f} {(len(times) - 1) / elapsed:>7.2f} {spacing:>16.3f} '
+                  f'{busiest:>10.2f}')
+            assert busiest <= rate * 1.05, f'{busiest:.2f} requests by second with a limit of {rate}'
+            assert (len(times) - 1) / elapsed >= rate * 0.8, f'only {(len(times) - 1) / elapsed:.2f} requests ' \
+                                                              f'by second with a limit of {rate}'
+        print('Rate limit checks passed.')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmarks on synthetic SRA data.')
+    parser.add_argument('--work_directory', default=None, help='Directory for generated files. Default is a '
+                                                               'temporary directory.')
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+    compression = benchmarks.add_parser('compression', help='Raw XML storage: plain x gzip x zstandard.')
+    compression.add_argument('--packages', type=int, default=20000, help='Number of EXPERIMENT_PACKAGE elements.')
+    structure = benchmarks.add_parser('structure', help='XML structure inference: iterparse x whole document.')
+    structure.add_argument('--packages', type=int, default=400000,
+                           help='Number of EXPERIMENT_PACKAGE elements. The default gives a file of about 1 GB.')
+    structure.add_argument('--skip_parse', action='store_true', default=False,
+                           help='Only run the iterparse inference, when the document does not fit in memory.')
+    ingest = benchmarks.add_parser('ingest', help='Database.create_from_xml: one row by transaction x COPY batches. '
+                                                  'Creates and drops a temporary database.')
+    ingest.add_argument('--packages', type=int, default=20000, help='Number of EXPERIMENT_PACKAGE elements.')
+    ingest.add_argument('--baseline_packages', type=int, default=1000,
+                        help='Number of EXPERIMENT_PACKAGE elements inserted one row by transaction.')
+    ingest.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help='Numbers of insertion processes to compare, e.g. --workers 1 2 4.')
+    consolidate = benchmarks.add_parser('consolidate', help='Database.add_all_to_consolidated_mesh_terms_table: one '
+                                                            'INSERT by field x set-based SQL. Creates and drops a '
+                                                            'temporary database.')
+    consolidate.add_argument('--packages', type=int, default=21000,
+                             help='Number of EXPERIMENT_PACKAGE elements. The default gives about 1 million attribute '
+                                  'rows.')
+    consolidate.add_argument('--baseline_rows', type=int, default=50000,
+                             help='Attribute rows inserted one by one before stopping the previous method.')
+    resume = benchmarks.add_parser('resume', help='SRA.search checkpoints: interrupts a download from a local '
+                                                  'E-utilities stand-in and checks the pages fetched on resume.')
+    resume.add_argument('--records', type=int, default=400, help='Number of records of the query.')
+    resume.add_argument('--pagination', type=int, default=20, help='Records by page.')
+    rate_limit = benchmarks.add_parser('rate_limit', help='SRA.pages request spacing, measured by a local E-utilities '
+                                                          'stand-in, at 3 and 10 requests by second.')
+    rate_limit.add_argument('--records', type=int, default=400, help='Number of records of the query.')
+    rate_limit.add_argument('--pagination', type=int, default=20, help='Records by page.')
+    catalog = benchmarks.add_parser('catalog', help='Schema catalog: checks that consolidated tables created by '
+                                                    'Database.get_counts_file are described. Creates and drops a '
+                                                    'temporary database.')
+    catalog.add_argument('--packages', type=int, default=100, help='Number of EXPERIMENT_PACKAGE elements.')
+    pool = benchmarks.add_parser('pool', help='Database connection pool: checks that instances beyond its capacity '
+                                              'fail after pool_timeout seconds.')
+    pool.add_argument('--timeout', type=float, default=1, help='pool_timeout of the instances, in seconds.')
+    for subparser in (ingest, consolidate, catalog, pool):
+        subparser.add_argument('--host', default='localhost')
+        subparser.add_argument('--password', action='store_true')
+        subparser.add_argument('--port', default=None)
+        subparser.add_argument('--user', default=None)
+    arguments = parser.parse_args()
+
+    with TemporaryDirectory(dir=arguments.work_directory) as work_directory:
+        if arguments.benchmark == 'compression':
+            benchmark_compression(arguments.packages, work_directory)
+        elif arguments.benchmark == 'structure':
+            benchmark_structure(arguments.packages, work_directory, in_memory=not arguments.skip_parse)
+        elif arguments.benchmark == 'resume':
+            benchmark_resume(arguments.records, arguments.pagination, work_directory)
+        elif arguments.benchmark == 'rate_limit':
+            benchmark_rate_limit(arguments.records, arguments.pagination)
+        else:
+            connection = {'host': arguments.host, 'user': arguments.user, 'port': arguments.port,
+                          'password': getpass.getpass('Database password: ') if arguments.password else None}
+            connection = {key: value for key, value in connection.items() if value is not None}
+            if arguments.benchmark == 'ingest':
+                benchmark_ingest(arguments.packages, arguments.baseline_packages, work_directory, connection,
+                                 workers=arguments.workers)
+            elif arguments.benchmark == 'consolidate':
+                benchmark_consolidate(arguments.packages, arguments.baseline_rows, work_directory, connection)
+            elif arguments.benchmark == 'catalog':
+                benchmark_catalog(arguments.packages, work_directory, connection)
+            elif arguments.benchmark == 'pool':
+                benchmark_pool(connection, arguments.timeout)
@@ -0,0 +1,125 @@
+from io import StringIO
+import logging
+
+
+class BulkInsert:
+    """Buffer rows by table and write them with COPY FROM STDIN.
+
+    Rows are kept in memory until batch_size rows are buffered, then every table is copied and the batch is committed
+    in a single transaction. If the COPY of a table fails, its rows are inserted one by one so only the invalid rows
+    are lost, as with one INSERT by row.
+
+    With commit=False the batches are written in the transaction of the caller, e.g. into temporary tables while a
+    cursor of the same connection is still open."""
+    def __init__(self, connection, batch_size=100000, order=None, commit=True):
+        """
+        :param connection: psycopg2 connection.
+        :param batch_size: Rows buffered before writing a batch.
+        :param order: Function giving the sort key of a table, so referenced tables are written first.
+        :param commit: Commit each batch. Otherwise the transaction is left to the caller.
+        """
+        self.__connection = connection
+        self.__batch_size = batch_size
+        self.__order = order
+        self.__commit = commit
+        self.__buffers = {}
+        self.__columns = {}
+        self.__buffered_rows = 0
+        self.rows = 0
+
+    def add(self, table, columns, values):
+        """
+        Buffer a row.
+        :param table: Table name.
+        :param columns: Column names, the same for every row of the table.
+        :param values: Row values.
+        """
+        if table not in self.__buffers:
+            self.__buffers[table] = []
+            self.__columns[table] = tuple(columns)
+        self.__buffers[table].append(values)
+        self.__buffered_rows += 1
+        if self.__buffered_rows >= self.__batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows in one transaction."""
+        if self.__buffered_rows == 0:
+            return
+        tables = list(self.__buffers)
+        if self.__order is not None:
+            tables.sort(key=self.__order)
+        for table in tables:
+            rows = self.__buffers[table]
+            columns = ', '.join(self.__columns[table])
+            data = StringIO()
+            for row in rows:
+                data.write('\t'.join(self.__copy_value(value) for value in row))
+                data.write('\n')
+            data.seek(0)
+            try:
+                with self.__connection.cursor() as cursor:
+                    cursor.execute('SAVEPOINT bulk_insert')
+                    cursor.copy_expert(f'COPY "{table}" ({columns}) FROM STDIN', data)
+                    cursor.execute('RELEASE SAVEPOINT bulk_insert')
+                self.rows += len(rows)
+            except Exception as err:
+                logging.warning(f'{err}. COPY into {table} failed, inserting its {len(rows)} rows one by one.')
+                with self.__connection.cursor() as cursor:
+                    cursor.execute('ROLLBACK TO SAVEPOINT bulk_insert')
+                    query = f'INSERT INTO "{table}"({columns}) VALUES ({",".join(["%s"] * len(self.__columns[table]))})'
+                    for row in rows:
+                        try:
+                            cursor.execute('SAVEPOINT bulk_insert_row')
+                            cursor.execute(query, row)
+                            cursor.execute('RELEASE SAVEPOINT bulk_insert_row')
+                            self.rows += 1
+                        except Exception as row_err:
+                            cursor.execute('ROLLBACK TO SAVEPOINT bulk_insert_row')
+                            logging.error(f"{row_err}. 'Data insertion failed. Table: {table}")
+        if self.__commit:
+            self.__connection.commit()
+        self.__buffers = {}
+        self.__buffered_rows = 0
+
+    @staticmethod
+    def __copy_value(value):
+        # formato texto do COPY: \N para nulo e escape de barra, tabulação e quebras de linha
+        if value is None:
+            return '\\N'
+        if value is True or value is False:
+            return 'true' if value else 'false'
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+        elif self.__commit:
+            self.__connection.rollback()
+
+
+class IdAllocator:
+    """Pre-assign internal_id ranges to blocks of records.
+
+    Each block receives, for every table, the IDs following the ones of the blocks allocated before it, so blocks can
+    be inserted in any order and by any process without duplicate keys, and the IDs are the same as inserting the
+    whole document sequentially."""
+    def __init__(self, last_ids=None):
+        """
+        :param last_ids: Last internal ID already used by each table (element path).
+        """
+        self.last_ids = {} if last_ids is None else dict(last_ids)
+
+    def allocate(self, counts):
+        """
+        Reserve the IDs of a block.
+        :param counts: Number of elements by table (element path) in the block.
+        :return: Last internal ID before the block, by table.
+        """
+        first_ids = dict(self.last_ids)
+        for name, count in counts.items():
+            self.last_ids[name] = self.last_ids.get(name, 0) + count
+        return first_ids
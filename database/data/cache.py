@@ -0,0 +1,102 @@
+from hashlib import sha256
+from os import makedirs
+from os import path
+from os import remove
+from os import replace
+from os import stat
+from os import utime
+from os import walk
+from threading import Lock
+from threading import get_ident
+from time import time
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+import gzip
+
+
+class ResponseCache:
+    """On-disk cache of HTTP responses.
+
+    Each response is stored gzip compressed in a file named by the SHA-256 of its normalized request. Entries older
+    than the TTL are ignored and, when the cache grows beyond its maximum size, the least recently used entries are
+    removed."""
+    def __init__(self, directory, ttl=None, max_size=None, offline=False):
+        """
+        :param directory: Cache directory.
+        :param ttl: Time to live of the entries in seconds. None keeps entries forever.
+        :param max_size: Maximum size of the cache in bytes. None does not limit the size.
+        :param offline: Never send requests, only answer from the cache.
+        """
+        self.__directory = directory
+        self.__ttl = ttl
+        self.__max_size = max_size
+        self.offline = offline
+        # parameters that do not change the response.
+        self.__ignored_parameters = {'api_key'}
+        self.__lock = Lock()
+        makedirs(self.__directory, exist_ok=True)
+        self.__size = sum(entry['size'] for entry in self.__entries())
+
+    def get(self, key):
+        file_name = self.__file_name(key)
+        try:
+            status = stat(file_name)
+        except FileNotFoundError:
+            return None
+        if self.__ttl is not None and time() - status.st_mtime > self.__ttl:
+            return None
+        # access time is the LRU clock, modification time is the TTL clock.
+        utime(file_name, (time(), status.st_mtime))
+        with gzip.open(file_name, 'rb') as file:
+            return file.read()
+
+    def key(self, url, parameters=None):
+        scheme, netloc, url_path, query, _ = urlsplit(url)
+        items = parse_qsl(query, keep_blank_values=True)
+        if parameters is not None:
+            items.extend((name, str(value)) for name, value in parameters.items())
+        items = sorted((name, value) for name, value in items if name not in self.__ignored_parameters)
+        return sha256(urlunsplit((scheme.lower(), netloc.lower(), url_path, urlencode(items), '')).encode()).hexdigest()
+
+    def set(self, key, data):
+        file_name = self.__file_name(key)
+        makedirs(path.dirname(file_name), exist_ok=True)
+        temporary_file_name = f'{file_name}.{get_ident()}.tmp'
+        with gzip.open(temporary_file_name, 'wb') as file:
+            file.write(data)
+        size = stat(temporary_file_name).st_size
+        previous_size = stat(file_name).st_size if path.exists(file_name) else 0
+        replace(temporary_file_name, file_name)
+        with self.__lock:
+            self.__size += size - previous_size
+            if self.__max_size is not None and self.__size > self.__max_size:
+                self.__evict()
+
+    def __entries(self):
+        for root, _, files in walk(self.__directory):
+            for file in files:
+                if file.endswith('.gz'):
+                    file_name = path.join(root, file)
+                    try:
+                        status = stat(file_name)
+                    except FileNotFoundError:
+                        continue
+                    yield {'file': file_name, 'size': status.st_size, 'atime': status.st_atime}
+
+    def __evict(self):
+        # removing least recently used entries until the cache is 10% below its maximum size.
+        entries = sorted(self.__entries(), key=lambda entry: entry['atime'])
+        self.__size = sum(entry['size'] for entry in entries)
+        for entry in entries:
+            if self.__size <= self.__max_size * 0.9:
+                break
+            try:
+                remove(entry['file'])
+                self.__size -= entry['size']
+            except FileNotFoundError:
+                pass
+
+    def __file_name(self, key):
+        return path.join(self.__directory, key[:2], f'{key}.xml.gz')
@@ -2,10 +2,15 @@ from copy import deepcopy
 from shutil import copyfile
 
 from . import xml as XML
+from .bulk import BulkInsert, IdAllocator
 from .mining import Mining
-from .util import format_name, NONE_VALUES, StatusBar
+from .util import format_name, NONE_VALUES, open_file, StatusBar
+from collections import Counter
+from collections import deque
 from collections import namedtuple
 from concurrent.futures import ProcessPoolExecutor, as_completed, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextlib import nullcontext
 from enum import Enum
 from enum import auto
 from kmodes.kmodes import KModes
@@ -13,10 +18,16 @@ from kneed import KneeLocator
 from lxml import etree
 from multiprocessing import cpu_count
 from nltk import Tree
+from os import getpid
 from os import path
+from psycopg2.pool import PoolError
+from psycopg2.pool import ThreadedConnectionPool
 from sqlalchemy import create_engine
 from tempfile import NamedTemporaryFile
+from threading import BoundedSemaphore
 from threading import Lock
+from uuid import uuid4
+import json
 import logging
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -32,8 +43,33 @@ class DBMS(Enum):
 class Database:
     static_mining = None
 
+    # pools de conexões compartilhados pelas instâncias, por processo e parâmetros de conexão
+    pools = {}
+    pools_lock = Lock()
+    # catálogos do esquema (tabelas, colunas e referências) em memória, por banco de dados e esquema
+    catalogs = {}
+    # tabelas com accession mapeadas na tabela record_accession, pelo prefixo das suas colunas
+    record_accession_tables = {
+        'experiment_package_sample': 'sample',
+        'experiment_package_experiment': 'experiment',
+        'experiment_package_study': 'study',
+        'experiment_package_run_set_run': 'run',
+    }
+
     def __init__(self, database, host='localhost', user=None, password=None, port=None, dbms=DBMS.POSTGRESQL,
-                 schema='data_mining', limit_record_number=None, chunk_size=100000):
+                 schema='data_mining', limit_record_number=None, chunk_size=100000, pool_min_size=1,
+                 pool_max_size=20, pool_timeout=60, itersize=10000):
+        """
+        Connections are taken from a pool shared by every instance of this process with the same connection
+        parameters, only when first used, and returned to the pool by close (or when the instance is deleted).
+        :param pool_min_size: Connections kept open by the pool. Used only by the instance creating the pool.
+        :param pool_max_size: Maximum number of connections of the pool. Each instance reserves two when it takes its
+        first one, so at most pool_max_size // 2 instances hold connections at once and the others wait for an
+        instance to close. Reserving both together keeps instances from waiting on each other for the second one.
+        :param pool_timeout: Seconds to wait for an instance to close when the pool is exhausted, before raising
+        PoolError. None waits indefinitely.
+        :param itersize: Rows read by round trip from server side cursors, used by large scans.
+        """
         self.__database = database
         self.__dbms = dbms
         self.__limit_record_number = limit_record_number
@@ -53,11 +89,16 @@ class Database:
         if port is not None:
             self.__parameters['port'] = port
         self.__chunk_size = chunk_size
-        self.__connection = None
-        self.__connection_2 = None
-        if dbms == DBMS.POSTGRESQL:
-            self.__connection = psycopg2.connect(**self.__parameters)
-            self.__connection_2 = psycopg2.connect(**self.__parameters)
+        self.__itersize = itersize
+        # registros (filhos da raiz do XML) lidos por vez na inserção
+        self.__records_by_block = 1000
+        self.__pool_size = (pool_min_size, pool_max_size)
+        self.__pool_timeout = pool_timeout
+        self.__connections = [None, None]
+        # vaga do pool (duas conexões) reservada por esta instância
+        self.__pool_slot = False
+        self.__catalog = None
+        self.__record_accessions = None
         self.mining = self.static_mining
         # TODO: check word size length to consider data as unstructured
         self.__word_size_length_unstructured = 10
@@ -83,7 +124,7 @@ class Database:
     def add_all_to_consolidated_mesh_terms_table(self):
         ignored_tables = {}
         ignored_columns = {}
-        with self.__connection.cursor() as cursor, self.__connection.cursor() as cursor_2:
+        with self.__connection.cursor() as cursor:
             ignored = self.get_ignored_fields_with_schema()
             # listando tabelas proibidas
             for item in ignored['tables']:
@@ -126,17 +167,8 @@ class Database:
                     ignored_columns[schema][table].add(field_a)
                     ignored_columns[schema][table].add(field_b)
 
-            reference_table = 'experiment_package_sample'
             temporary_table = f'temp_table_data'
 
-            cursor.execute(f"""create temporary table {temporary_table}_ids (
-                schema_name text,
-                table_name text,
-                column_name text,
-                internal_id bigint,
-                sample_accession text
-            )""")
-
             cursor.execute(f"""
             create temporary table {temporary_table} (
                 schema_name text,
@@ -148,197 +180,112 @@ class Database:
             )
             """)
 
+            self.update_record_accessions()
             tables = self.get_tables_columns(show_type=False, data_mining_tables=False)
             with StatusBar('Loading tables data...', len(tables)) as status_bar:
-                query_insert = f"""
-                insert into {temporary_table}(schema_name, table_name, column_name, internal_id, sample_accession, value)
-                values(%s, %s, %s, %s, %s, %s)
-                """
                 for table in tables:
                     schema = tables[table]['schema']
                     if schema in ignored_tables:
                         if table in ignored_tables[schema]:
+                            status_bar.update()
                             continue
-                    query = f"""select * from {schema}.{table}"""
+                    # ignorando campos proibidos ou não estruturados.
+                    columns = [column for column in tables[table]['columns']
+                               if column != 'internal_id' and column not in ignored_columns.get(schema, {}).get(table, set())]
+                    if len(columns) == 0:
+                        status_bar.update()
+                        continue
+                    source = f"{schema}.{table}"
                     if self.__limit_record_number is not None:
-                        query = f"{query} order by random() limit {self.__limit_record_number}"
-                    cursor_2.execute(query)
-                    columns = [column.name for column in cursor_2.description]
-                    for row in self.__unpack_results(cursor_2):
-                        record = dict(zip(columns, row))
-                        for column in columns:
-                            if column != 'internal_id':
-                                # ignorando campos proibidos ou não estruturados.
-                                if schema in ignored_columns:
-                                    if table in ignored_columns[schema]:
-                                        if column in ignored_columns[schema][table]:
-                                            continue
-                                if record[column] is not None:
-                                    cursor.execute(
-                                        query_insert,
-                                        [
-                                            schema,
-                                            table,
-                                            column,
-                                            record['internal_id'],
-                                            None,  # sample_accesion
-                                            record[column]
-                                        ]
-                                    )
-                    status_bar.update()
-            cursor_2.execute(f"""select 
-                            schema_name, table_name, column_name, array_agg(distinct(internal_id)) as internal_ids 
-                        from {temporary_table}
-                        group by schema_name, table_name, column_name;""")
-            with StatusBar('Recovering accession numbers...', cursor_2.rowcount + 1) as status_bar:
-                query = f"""insert into {temporary_table}_ids (schema_name, table_name, column_name, internal_id, 
-                sample_accession) values (%s, %s, %s, %s, %s);"""
-                for schema_name, table_name, column_name, internal_ids in self.__unpack_results(cursor_2):
-                    for sample in self.get_table_related_data(
-                            table=table_name, table_internal_id=internal_ids,
-                            reference_table=reference_table):
-                        cursor.execute(query, (
-                            schema_name,
-                            table_name,
-                            column_name,
-                            sample[f'{table_name}_internal_id'],
-                            sample[f'{reference_table}_accession']
-                        ))
+                        source = f"(select * from {source} order by random() limit {self.__limit_record_number})"
+                    # uma linha (coluna, valor) por campo não nulo de cada registro, com o accession da amostra
+                    values = ', '.join(f"""('{column}', "{table}"."{column}"::text)""" for column in columns)
+                    cursor.execute(f"""
+                    insert into {temporary_table}(schema_name, table_name, column_name, internal_id, sample_accession, value)
+                    select %s, %s, field.column_name, "{table}".internal_id, record_accession.sample_accession, field.value
+                    from {source} as "{table}"
+                    cross join lateral (values {values}) as field(column_name, value)
+                    left join record_accession on record_accession.table_name = %s
+                        and record_accession.internal_id = "{table}".internal_id
+                    where field.value is not null
+                    """, (schema, table, table))
                     status_bar.update()
+            cursor.execute(f"""analyze {temporary_table}""")
+
+            with StatusBar('Preparing sample consolidated data...', 2) as status_bar:
+                query = f"""select * from {self.__schema}.consolidated_sample"""
+                if self.__limit_record_number is not None:
+                    query = f"""{query} order by random() limit {self.__limit_record_number}"""
+                # valores distintos de cada coluna por amostra, somados aos já consolidados; o primeiro valor vai para a
+                # linha da amostra e cada um dos demais para uma linha própria
                 cursor.execute(f"""
-                update {temporary_table}
-                set sample_accession = accessions.sample_accession
+                create temporary table temp_consolidated_value as
+                select accession, column_name, value,
+                    row_number() over (partition by accession, column_name order by value) as position
                 from (
-                    select
-                        schema_name, table_name, column_name, internal_id, sample_accession
-                    from {temporary_table}_ids
-                    group by schema_name, table_name, column_name, internal_id, sample_accession
-                ) as accessions
-                where {temporary_table}.schema_name = accessions.schema_name
-                    and {temporary_table}.table_name = accessions.table_name
-                    and {temporary_table}.column_name = accessions.column_name
-                    and {temporary_table}.internal_id = accessions.internal_id
+                    select sample_accession as accession, column_name, value
+                    from {temporary_table}
+                    union
+                    select consolidated.accession, field.key, field.value
+                    from ({query}) as consolidated
+                    cross join lateral jsonb_each_text(to_jsonb(consolidated) - 'accession') as field
+                    where field.value is not null
+                ) as consolidated_value
+                where column_name <> 'accession'
                 """)
                 status_bar.update()
-
-            consolidated = {}
-            cursor.execute(f"""
-            select sample_accession, column_name, value
-            from {temporary_table}
-            group by column_name, sample_accession, value
-            """)
-            query = f"""
-            select * from {self.__schema}.consolidated_sample
-            """
-            if self.__limit_record_number is not None:
-                query = f"""{query} order by random() limit {self.__limit_record_number}"""
-            cursor_2.execute(query)
-            with StatusBar('Preparing sample consolidated data...', cursor.rowcount + cursor_2.rowcount) as status_bar:
-                for accession, column, value in self.__unpack_results(cursor):
-                    if value is not None:
-                        if accession not in consolidated:
-                            consolidated[accession] = {column: {value}}
-                        elif column not in consolidated[accession]:
-                            consolidated[accession][column] = {value}
-                        else:
-                            consolidated[accession][column].add(value)
-                    status_bar.update()
-                columns = [column.name for column in cursor_2.description]
-                for row in self.__unpack_results(cursor_2):  # checar sobre escritas
-                    record = dict(zip(columns, row))
-                    accession = record['accession']
-                    for column in set(columns) - {'accession'}:
-                        value = record[column]
-                        if value is not None:
-                            if accession not in consolidated:
-                                consolidated[accession] = {column: {value}}
-                            elif column not in consolidated[accession]:
-                                consolidated[accession][column] = {value}
-                            else:
-                                consolidated[accession][column].add(value)
-                    status_bar.update()
-
-            with StatusBar('Writing data to database...', 5 + (len(consolidated) * 2)) as status_bar:
-                columns = {}
-                for accession, value in consolidated.items():
-                    value['accession'] = accession
-                status_bar.update()
-                consolidated = [value for accession, value in consolidated.items()]
+                # tipo de cada coluna: bigint ou double precision quando todos os valores são números
+                cursor.execute(f"""
+                select column_name,
+                    case
+                        when not bool_and(value ~ '^-?([0-9]+[.]?[0-9]*|[.][0-9]+)$') then 'text'
+                        when bool_or(strpos(value, '.') > 0) then 'double precision'
+                        else 'bigint'
+                    end
+                from temp_consolidated_value
+                group by column_name
+                """)
+                columns = dict(cursor.fetchall())
                 status_bar.update()
-                for row in consolidated:
-                    temp = deepcopy(row)
-                    for column, value in temp.items():
-                        if isinstance(value, set):
-                            type_column = columns[column] if column in columns else None
-                            for i, item in enumerate(value):
-                                if type_column != 'text':
-                                    if not isinstance(item, str):
-                                        print(f'{item} não é uma string.')
-                                    else:
-                                        if '-' in item and not item.startswith('-'):
-                                            type_column = 'text'
-                                        elif type_column != 'double precision' and item.replace('.', '', 1).replace('-',
-                                                                                                                    '',
-                                                                                                                    1).isnumeric():
-                                            if '.' in item:
-                                                type_column = 'double precision'
-                                            else:
-                                                type_column = 'bigint'
-                                        else:
-                                            type_column = 'text'
-                                if i == 0:
-                                    row[column] = deepcopy(item)
-                                else:
-                                    row_temp = {'accession': deepcopy(row['accession']), column: deepcopy(item)}
-                                    consolidated.append(row_temp)
-                            columns[column] = type_column
-
-                    status_bar.update()
 
+            with StatusBar('Writing data to database...', 3) as status_bar:
                 temporary_table = 'temp_consolidated_sample'
-                query = f"""create table if not exists {self.__schema}.{temporary_table}(accession text"""
+                cursor.execute(f"""drop table if exists {self.__schema}.{temporary_table}""")
+                query = f"""create table {self.__schema}.{temporary_table}(accession text"""
                 for column in sorted(columns):
                     query = f"""{query}, "{column}" {columns[column]}"""
                 query = f"""{query});"""
                 cursor.execute(query)
-                self.__connection.commit()
-
                 status_bar.update()
 
-                for row in consolidated:
-                    temp_columns = list(row.keys())
-                    query = f"""insert into {self.__schema}.{temporary_table} ({', '.join([f'"{column}"' for column in temp_columns])})"""
-                    query = f"""{query} values ({', '.join(('%s',) * len(row))})"""
-                    values = []
-                    for column in temp_columns:
-                        if column == 'accession':
-                            values.append(row[column])
-                        elif columns[column] == 'double precision':
-                            values.append(float(row[column]))
-                        elif columns[column] == 'bigint':
-                            values.append(int(row[column]))
-                        else:
-                            values.append(row[column])
-                    cursor.execute(query, values)
-                    status_bar.update()
-
-                self.__connection.commit()
-
-                cursor.execute(f"""drop table {self.__schema}.consolidated_sample;""")
-                self.__connection.commit()
-
+                # jsonb_populate_record converte os valores para o tipo de cada coluna
                 cursor.execute(f"""
-                create table {self.__schema}.consolidated_sample as
-                select * from {self.__schema}.{temporary_table}
-                """)
-
-                cursor.execute(f"""
-                drop table {self.__schema}.{temporary_table}
+                insert into {self.__schema}.{temporary_table}
+                select record.*
+                from (
+                    select accession, jsonb_object_agg(column_name, value) as fields
+                    from temp_consolidated_value
+                    where position = 1
+                    group by accession
+                    union all
+                    select accession, jsonb_build_object(column_name, value)
+                    from temp_consolidated_value
+                    where position > 1
+                ) as consolidated
+                cross join lateral jsonb_populate_record(
+                    null::{self.__schema}.{temporary_table},
+                    consolidated.fields || jsonb_build_object('accession', consolidated.accession)
+                ) as record
                 """)
+                cursor.execute(f"""drop table temp_consolidated_value""")
+                status_bar.update()
 
+                cursor.execute(f"""drop table {self.__schema}.consolidated_sample""")
+                cursor.execute(f"""alter table {self.__schema}.{temporary_table} rename to consolidated_sample""")
                 self.__connection.commit()
 
                 status_bar.update()
+        self.invalidate_schema_cache()
 
     # create database structure for application.
     def create_annotation_tables(self):
@@ -371,9 +318,11 @@ class Database:
                                     table_name text not null,
                                     column_name text not null,
                                     internal_id bigint not null,
-                                    tree text 
+                                    tree text,
+                                    entities jsonb
                                 );""")
             self.__connection.commit()
+            self.update_annotation_entities()
 
             cursor.execute(f"""create table if not exists {self.__schema}.table_unstructured_field(
                             internal_id bigserial,
@@ -505,6 +454,7 @@ class Database:
                     index_label='accession',
                     chunksize=self.__chunk_size,
                 )
+        self.invalidate_schema_cache()
 
     def create_ignored_fields_tables(self):
         with self.__connection.cursor() as cursor:
@@ -595,11 +545,8 @@ class Database:
 
             query = f"""insert into {temp_table_name} (
                 schema_name, table_name, column_name, internal_id, category, mesh_term, term, sample_accession)
-                values (%s, %s, %s, %s, %s, %s, %s, %s);"""
-            for term in self.get_mining_terms():
-                cursor.execute(query, (
-                    term['schema_name'], term['table_name'], term['column_name'], term['internal_id'], term['category'],
-                    term['mesh_term'], term['term'], term['sample_accession']))
+                {self.__mining_terms_query()}"""
+            cursor.execute(query)
 
             query = f"""insert into {consolidated_table_name}
                     (schema_name, table_name, column_name, internal_id, category, mesh_term, term, sample_accession)
@@ -663,12 +610,16 @@ class Database:
                         )""")
 
             with open(path.join(path.dirname(path.realpath(__file__)), 'template', 'drug_name')) as drug_file:
-                for drug_name in drug_file:
-                    drug_name = drug_name.strip()
-                    if len(drug_name) > 0:
-                        cursor.execute(f"""
-                        insert into {temporary_table} (name) values (%s)
-                        """, (drug_name, ))
+                with self.__batch_writer() as writer:
+                    for drug_name in drug_file:
+                        drug_name = drug_name.strip()
+                        if len(drug_name) > 0:
+                            writer.add(temporary_table, ('name',), (drug_name,))
+                self.__connection.commit()
+                # a junção por ilike usa o índice de trigramas da tabela temporária, que não é analisada pelo autovacuum
+                if self.__trigram_available(cursor):
+                    self.__create_index(cursor, temporary_table, 'name gin_trgm_ops', 'gin')
+                cursor.execute(f'ANALYZE {temporary_table};')
                 self.__connection.commit()
 
                 cursor.execute(f"""
@@ -731,7 +682,7 @@ class Database:
                 for table in drug_columns[schema]:
                     size += len(table_columns[schema][table])
             with StatusBar('Searching for samples in drug columns...', size) as status_bar:
-                with self.__connection.cursor() as cursor_2:
+                with self.__batch_writer() as writer:
                     for schema in drug_columns:
                         for table in drug_columns[schema]:
                             for item in drug_columns[schema][table]:
@@ -755,31 +706,22 @@ class Database:
                                         value = value.strip()
                                         if value not in NONE_VALUES:
                                             accession = row['experiment_package_sample_accession']
-                                            cursor_2.execute(f"""
-                                            insert into {temporary_table} (sample_accession, drug)
-                                            values (%s, %s)
-                                            """, (accession, drug))
+                                            writer.add(temporary_table, ('sample_accession', 'drug'), (accession, drug))
                             status_bar.update()
 
             # procurando drogas em substâncias mapeadas
-            cursor.execute(f"""
+            query = f"""
             select sample_accession, mesh_term, term from {self.__schema}.sample_mining_terms where category = 'name of substance'
-            """)
-
-            with StatusBar('Searching for drugs in MeSh terms...', cursor.rowcount) as status_bar:
-                with self.__connection.cursor() as cursor_2:
-                    for accession, mesh_term, term in self.__unpack_results(cursor):
-                        if mesh_term in drugs:
-                            cursor_2.execute(f"""
-                            insert into {temporary_table} (sample_accession, drug)
-                            values (%s, %s)
-                            """, (accession, mesh_term))
-                        elif term in drugs:
-                            cursor_2.execute(f"""
-                            insert into {temporary_table} (sample_accession, drug)
-                            values (%s, %s)
-                            """, (accession, term))
-                status_bar.update()
+            """
+            with StatusBar('Searching for drugs in MeSh terms...', self.__estimate_rows(query)) as status_bar, \
+                    self.__server_cursor() as cursor_terms, self.__batch_writer() as writer:
+                cursor_terms.execute(query)
+                for accession, mesh_term, term in self.__unpack_results(cursor_terms):
+                    if mesh_term in drugs:
+                        writer.add(temporary_table, ('sample_accession', 'drug'), (accession, mesh_term))
+                    elif term in drugs:
+                        writer.add(temporary_table, ('sample_accession', 'drug'), (accession, term))
+                    status_bar.update()
 
             # procurando drogas em todas as tabelas
             size = 0
@@ -787,7 +729,7 @@ class Database:
                 for table in other_columns[schema]:
                     size += len(other_columns[schema][table])
             with StatusBar('Searching for drugs in all fields...', size) as status_bar:
-                with self.__connection.cursor() as cursor_2:
+                with self.__batch_writer() as writer:
                     for schema in other_columns:
                         for table in other_columns[schema]:
                             for column in other_columns[schema][table]:
@@ -828,10 +770,8 @@ class Database:
                                                 if is_drug:
                                                     for d in drug:
                                                         accession = row['experiment_package_sample_accession']
-                                                        cursor_2.execute(f"""
-                                                        insert into {temporary_table} (sample_accession, drug)
-                                                        values (%s, %s)
-                                                        """, (accession, d))
+                                                        writer.add(temporary_table, ('sample_accession', 'drug'),
+                                                                   (accession, d))
                                 status_bar.update()
 
             print('Persisting data...')
@@ -849,67 +789,590 @@ class Database:
             where cds.accession is null and cds.drug is null
             """)
             self.__connection.commit()
+        self.invalidate_schema_cache()
 
     # create database structure from xml
-    def create_from_xml(self, xml, create_structure=True):
-        data = etree.parse(xml, etree.XMLParser(remove_blank_text=True, remove_comments=True))
+    def create_from_xml(self, xml, create_structure=True, workers=None, batch_size=None,
+                        defer_constraints=True) -> int:
+        """
+        Create and populate the database from an XML file or from a directory of XML shards (page_*.xml files
+        written by SRA.search). Shards are inserted in parallel, one database connection by worker process.
+        :param xml: XML file or directory of shards. Compressed files (.gz, .zst) are read transparently.
+        :param create_structure: Create the tables before inserting data.
+        :param workers: Number of worker processes, each one with its own connection, inserting shards or blocks of
+        records. Default is the number of CPUs. With 1 the records are inserted by this process.
+        :param batch_size: Rows written by transaction. Default is the chunk size of the database.
+        :param defer_constraints: Create new tables without primary keys, foreign keys and indexes, and add them after
+        the data is loaded, followed by ANALYZE. Tables that already exist keep their constraints.
+        :return: Number of inserted rows.
+        """
         entities = {}
+        # tabelas novas e referências cujas restrições são criadas depois da carga
+        deferred_tables = []
+        deferred_references = []
         references = {}
         paths = {}
         logging.info('Analyzing XML structure...')
         start_node = 'EXPERIMENT_PACKAGE'
-        XML.generate_structure(data.getroot(), entities, references, paths, start_node=start_node)
+        if path.isdir(xml):
+            shards = XML.list_shards(xml)
+            element_counts = self.__generate_shards_structure(shards, entities, references, None, start_node)
+        else:
+            with open_file(xml) as xml_file:
+                root_tag = XML.generate_structure_from_file(xml_file, entities, references, None,
+                                                            start_node=start_node)
         logging.info('Creating database structure...')
         with StatusBar('Creating database structure', len(entities) * 2) as status_bar:
             if create_structure:
                 bar_position = 0
                 status_bar.update()
                 with self.__connection.cursor() as cursor:
-                    query = f"""CREATE TABLE table_name(
+                    query = f"""CREATE TABLE IF NOT EXISTS table_name(
                         id text primary key,
                         name text,
                         reference text
                     );"""
                     cursor.execute(query)
+                    # tabelas já existentes (atualização incremental) recebem apenas as colunas novas
+                    cursor.execute("""select table_name, column_name from information_schema.columns 
+                    where table_schema = 'public'""")
+                    existing_columns = {}
+                    for table_name, column_name in cursor.fetchall():
+                        existing_columns.setdefault(table_name, set()).add(column_name)
                     # TODO: inserir a tabela raiz na tabela de metadados (table_name)
                     for entity in entities:
-                        query = f'CREATE TABLE "{self.get_short_name(entity)}"('
-                        query += 'internal_id BIGINT PRIMARY KEY'
-                        for i, field in enumerate(entities[entity]):
-                            if field != 'internal_id':
-                                query += f', {field} {entities[entity][field]["type"]}'
-                        query += f""");"""
-                        cursor.execute(query)
+                        if self.get_short_name(entity) in existing_columns:
+                            for field in entities[entity]:
+                                if field not in existing_columns[self.get_short_name(entity)]:
+                                    cursor.execute(f'ALTER TABLE "{self.get_short_name(entity)}" '
+                                                   f'ADD COLUMN {field} {entities[entity][field]["type"]};')
+                        else:
+                            query = f'CREATE TABLE "{self.get_short_name(entity)}"('
+                            if defer_constraints:
+                                query += 'internal_id BIGINT'
+                                deferred_tables.append(self.get_short_name(entity))
+                            else:
+                                query += 'internal_id BIGINT PRIMARY KEY'
+                            for i, field in enumerate(entities[entity]):
+                                if field != 'internal_id':
+                                    query += f', {field} {entities[entity][field]["type"]}'
+                            query += f""");"""
+                            cursor.execute(query)
                         bar_position += 1
                         status_bar.update()
                     self.__connection.commit()
                     for entity in references:
+                        if f'{self.get_short_name(references[entity])}_id' in \
+                                existing_columns.get(self.get_short_name(entity), set()):
+                            bar_position += 1
+                            status_bar.update()
+                            continue
                         query = f'ALTER TABLE "{self.get_short_name(entity)}"'
                         query += f' ADD COLUMN {self.get_short_name(references[entity])}_id BIGINT;'
                         cursor.execute(query)
                         self.__connection.commit()
-                        query = f'ALTER TABLE "{self.get_short_name(entity)}"'
-                        query += f' ADD FOREIGN KEY ({self.get_short_name(references[entity])}_id)'
-                        query += f' REFERENCES "{self.get_short_name(references[entity])}"(internal_id)'
-                        query += f' ON UPDATE CASCADE ON DELETE RESTRICT;'
-                        cursor.execute(query)
+                        if self.get_short_name(entity) in deferred_tables:
+                            deferred_references.append(entity)
+                        else:
+                            cursor.execute(self.__foreign_key_query(entity, references))
                         cursor.execute(
-                            f"""INSERT INTO table_name(id, name, reference) VALUES (%s, %s, %s)""",
+                            f"""INSERT INTO table_name(id, name, reference) VALUES (%s, %s, %s)
+                            ON CONFLICT (id) DO NOTHING""",
                             (self.get_short_name(entity), entity, self.get_short_name(references[entity]))
                         )
                         self.__connection.commit()
                         bar_position += 1
                         status_bar.update()
         logging.info('Inserting database data...')
-        self.insert_from_xml(data.getroot(), entities, references, paths, start_node=start_node)
+        # novos registros continuam a numeração dos registros já existentes
+        last_ids = self.__last_internal_ids(entities)
+        if path.isdir(xml):
+            rows = self.__insert_shards(shards, element_counts, entities, references, start_node, workers, last_ids,
+                                        batch_size)
+        elif format_name(root_tag) in entities:
+            # a raiz também é uma tabela, o documento é inserido inteiro
+            with open_file(xml) as xml_file:
+                data = etree.parse(xml_file, etree.XMLParser(remove_blank_text=True, remove_comments=True))
+            rows = self.insert_from_xml(data.getroot(), entities, references, paths, last_ids=last_ids,
+                                        start_node=start_node, batch_size=batch_size)
+        else:
+            rows = self.__insert_file(xml, entities, references, root_tag, last_ids, batch_size, workers)
+        logging.info(f'{rows} rows inserted.')
+        if len(deferred_tables) > 0:
+            self.__create_deferred_constraints(deferred_tables, deferred_references, references)
+        # índices de junção e filtro, seguidos da atualização das estatísticas das tabelas carregadas
+        self.create_indexes([self.get_short_name(entity) for entity in entities])
+        self.invalidate_schema_cache()
+        self.update_record_accessions()
+        return rows
+
+    def __create_deferred_constraints(self, tables, foreign_keys, references):
+        logging.info('Creating primary keys and foreign keys...')
+        with StatusBar('Creating constraints', len(tables) + len(foreign_keys)) as status_bar:
+            with self.__connection.cursor() as cursor:
+                # chaves primárias antes das chaves estrangeiras que as referenciam
+                for table in tables:
+                    cursor.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY (internal_id);')
+                    status_bar.update()
+                for entity in foreign_keys:
+                    cursor.execute(self.__foreign_key_query(entity, references))
+                    status_bar.update()
+                self.__connection.commit()
 
-    def detect_data(self, cache: bool = False):
+    def create_indexes(self, tables: list = None, analyze: bool = True) -> list:
+        """
+        Create the indexes used by the navigator queries, skipping the ones that already exist:
+        b-tree on every reference column (<parent>_id), on accession and on lower(accession), and trigram (pg_trgm)
+        indexes on the pair fields (tag) and on the drug names, searched with ilike. Trigram indexes are skipped when
+        the pg_trgm extension is not available.
+        :param tables: Tables to index, on the public and data mining schemas. Default is every data table (listed on
+        table_name) and every data mining table.
+        :param analyze: Update the statistics of the tables, used by the planner to choose the indexes.
+        :return: List of created indexes, as (schema, table, key) tuples.
+        """
+        indexes = []
+        with self.__connection.cursor() as cursor:
+            cursor.execute("""select table_schema, table_name, column_name from information_schema.columns
+            where (table_schema = 'public' and table_name in (select id from public.table_name)) or table_schema = %s
+            order by table_schema, table_name, ordinal_position""", (self.__schema,))
+            columns = {}
+            for schema, table, column in cursor.fetchall():
+                if tables is None or table in tables:
+                    columns.setdefault((schema, table), []).append(column)
+            for (schema, table), table_columns in columns.items():
+                for column in table_columns:
+                    if column.endswith('_id') and column != 'internal_id':
+                        indexes.append((schema, table, column, 'btree'))
+                if 'accession' in table_columns:
+                    indexes.append((schema, table, 'accession', 'btree'))
+                    indexes.append((schema, table, 'lower(accession)', 'btree'))
+            if self.__trigram_available(cursor):
+                # campos pares (tag/value), buscados com ilike nos sub pares, e nomes de medicamentos
+                trigram_columns = [(self.__schema, 'drug_name', 'name')]
+                cursor.execute("""select to_regclass(%s)""", (f'{self.__schema}.table_pair_field',))
+                if cursor.fetchone()[0] is not None:
+                    cursor.execute(f"""select 'public', table_name, field_a from {self.__schema}.table_pair_field""")
+                    trigram_columns.extend(cursor.fetchall())
+                for schema, table, column in trigram_columns:
+                    if (schema, table) in columns and column in columns[(schema, table)]:
+                        indexes.append((schema, table, f'{column} gin_trgm_ops', 'gin'))
+            created = []
+            with StatusBar('Creating indexes', len(indexes)) as status_bar:
+                for schema, table, key, method in indexes:
+                    if self.__create_index(cursor, f'"{schema}"."{table}"', key, method):
+                        created.append((schema, table, key))
+                    status_bar.update()
+            self.__connection.commit()
+            if analyze:
+                for schema, table in columns:
+                    cursor.execute(f'ANALYZE "{schema}"."{table}";')
+                self.__connection.commit()
+        logging.info(f'{len(created)} indexes created.')
+        return created
+
+    def get_index_usage(self) -> dict:
+        """
+        Cumulative scans of each index and sequential scans of each table, from the server statistics. Statistics of
+        this object connections are flushed before reading them; other connections flush theirs when idle.
+        :return: Dictionary {'indexes': {(schema, table, index): scans}, 'tables': {(schema, table): scans}}.
+        """
+        if self.__connection.server_version >= 150000:
+            for connection in self.__connections:
+                if connection is None:
+                    continue
+                with connection.cursor() as cursor:
+                    cursor.execute('select pg_stat_force_next_flush()')
+                connection.commit()
+        usage = {'indexes': {}, 'tables': {}}
+        with self.__connection.cursor() as cursor:
+            cursor.execute('select pg_stat_clear_snapshot()')
+            cursor.execute("""select schemaname, relname, indexrelname, idx_scan from pg_stat_user_indexes""")
+            for schema, table, index, scans in cursor.fetchall():
+                usage['indexes'][(schema, table, index)] = scans
+            cursor.execute("""select schemaname, relname, seq_scan from pg_stat_user_tables""")
+            for schema, table, scans in cursor.fetchall():
+                usage['tables'][(schema, table)] = scans
+        self.__connection.commit()
+        return usage
+
+    @contextmanager
+    def index_usage_report(self, stage: str):
+        """
+        Log the indexes used, and the tables sequentially scanned, by a pipeline stage.
+        with database.index_usage_report('detect data'):
+            database.detect_data()
+        :param stage: Stage name, shown on the report.
+        """
+        before = self.get_index_usage()
+        yield
+        after = self.get_index_usage()
+        for kind, description in (('indexes', 'index scans'), ('tables', 'sequential scans')):
+            used = {key: scans - before[kind].get(key, 0) for key, scans in after[kind].items()
+                    if scans - before[kind].get(key, 0) > 0}
+            if len(used) == 0:
+                logging.info(f'{stage}: no {description}.')
+            for key, scans in sorted(used.items(), key=lambda item: -item[1]):
+                logging.info(f'{stage}: {scans} {description} on {".".join(key)}.')
+
+    @staticmethod
+    def __create_index(cursor, table, key, method='btree') -> bool:
+        # índices criados sem nome; a existência é verificada pela definição
+        cursor.execute("""select pg_get_indexdef(indexrelid) from pg_index where indrelid = %s::regclass""",
+                       (table,))
+        for definition, in cursor.fetchall():
+            if definition.endswith(f'USING {method} ({key})'):
+                return False
+        cursor.execute(f'CREATE INDEX ON {table} USING {method} ({key});')
+        return True
+
+    def __trigram_available(self, cursor) -> bool:
+        try:
+            cursor.execute('SAVEPOINT trigram')
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm;')
+            cursor.execute('RELEASE SAVEPOINT trigram')
+            return True
+        except psycopg2.Error as err:
+            cursor.execute('ROLLBACK TO SAVEPOINT trigram')
+            logging.warning(f'{str(err).splitlines()[0]}. Extension pg_trgm not available, skipping trigram indexes.')
+            return False
+
+    def update_record_accessions(self):
+        """
+        Map the rows of every data table without a mapping yet to the accessions of their experiment package, in the
+        record_accession table: (table_name, internal_id) -> sample, experiment and study (of the package) and run
+        (only for the run and the rows under it, as a package may have several runs). Called after each XML load.
+        """
+        tables = self.get_tables()
+        root = 'experiment_package'
+        with self.__connection.cursor() as cursor:
+            cursor.execute("""CREATE TABLE IF NOT EXISTS record_accession(
+                table_name text not null,
+                internal_id bigint not null,
+                experiment_package_id bigint,
+                sample_id bigint,
+                sample_accession text,
+                experiment_id bigint,
+                experiment_accession text,
+                study_id bigint,
+                study_accession text,
+                run_id bigint,
+                run_accession text
+            );""")
+            cursor.execute("""CREATE INDEX IF NOT EXISTS record_accession_record
+            ON record_accession(table_name, internal_id);""")
+            cursor.execute("""CREATE INDEX IF NOT EXISTS record_accession_experiment_package
+            ON record_accession(experiment_package_id);""")
+            self.__connection.commit()
+            self.__record_accessions = True
+            rows = 0
+            with StatusBar('Mapping records to accessions', len(tables)) as status_bar:
+                for table in tables:
+                    references = self.get_table_references(table)
+                    if references[-1]['name'] != root:
+                        status_bar.update()
+                        continue
+                    # junções até a raiz; a tabela de cada accession vem da cadeia ou do mesmo pacote
+                    chain = [reference['name'] for reference in references[:-1]]
+                    query = f'from "{table}"'
+                    for reference in references[:-2]:
+                        query += (f' join "{reference["destination table"]}" on "{reference["name"]}".'
+                                  f'{reference["origin key"]} = "{reference["destination table"]}".internal_id')
+                    package_id = f'"{references[-2]["name"]}".{root}_id'
+                    columns = [package_id]
+                    for accession_table, key in self.record_accession_tables.items():
+                        if accession_table in chain:
+                            columns.extend((f'"{accession_table}".internal_id', f'"{accession_table}".accession'))
+                        elif key != 'run' and accession_table in tables and tables[accession_table]['reference'] == root:
+                            query += (f' left join "{accession_table}" on "{accession_table}".{root}_id'
+                                      f' = {package_id}')
+                            columns.extend((f'"{accession_table}".internal_id', f'"{accession_table}".accession'))
+                        else:
+                            columns.extend(('null::bigint', 'null::text'))
+                    cursor.execute(f"""insert into record_accession(table_name, internal_id, experiment_package_id,
+                        sample_id, sample_accession, experiment_id, experiment_accession, study_id, study_accession,
+                        run_id, run_accession)
+                    select %s, "{table}".internal_id, {', '.join(columns)} {query}
+                    where not exists (select 1 from record_accession
+                        where record_accession.table_name = %s and record_accession.internal_id = "{table}".internal_id)
+                    """, (table, table))
+                    rows += cursor.rowcount
+                    status_bar.update()
+            self.__connection.commit()
+            cursor.execute('ANALYZE record_accession;')
+            self.__connection.commit()
+        logging.info(f'{rows} records mapped to accessions.')
+
+    def __record_accessions_exist(self, cursor) -> bool:
+        if self.__record_accessions is None:
+            cursor.execute("""select to_regclass('public.record_accession')""")
+            self.__record_accessions = cursor.fetchone()[0] is not None
+        return self.__record_accessions
+
+    def __record_accession_key(self, table, reference_table, references):
+        # prefixo das colunas de record_accession que levam de table a reference_table, se houver
+        if table == reference_table or reference_table not in self.record_accession_tables:
+            return None
+        key = self.record_accession_tables[reference_table]
+        if key == 'run' and reference_table not in [reference['name'] for reference in references]:
+            return None
+        with self.__connection.cursor() as cursor:
+            if not self.__record_accessions_exist(cursor):
+                return None
+        return key
+
+    def __foreign_key_query(self, entity, references):
+        query = f'ALTER TABLE "{self.get_short_name(entity)}"'
+        query += f' ADD FOREIGN KEY ({self.get_short_name(references[entity])}_id)'
+        query += f' REFERENCES "{self.get_short_name(references[entity])}"(internal_id)'
+        query += f' ON UPDATE CASCADE ON DELETE RESTRICT;'
+        return query
+
+    def get_experiment_accessions(self) -> set:
+        """
+        Accessions of the experiments already in the database.
+        :return: Set of experiment accessions.
+        """
+        with self.__connection.cursor() as cursor:
+            cursor.execute("""select 1 from information_schema.tables 
+            where table_schema = 'public' and table_name = 'experiment_package_experiment'""")
+            if cursor.fetchone() is None:
+                return set()
+            cursor.execute("""select accession from experiment_package_experiment where accession is not null""")
+            return {accession for accession, in self.__unpack_results(cursor)}
+
+    def delete_experiment_packages(self, accessions):
+        """
+        Delete the experiment packages of the given experiments, including the rows of every table referencing them,
+        their annotations and consolidated rows and the XML shards containing them. New records are numbered after the
+        highest internal ID left in each table, so freed IDs are only used again when they were the highest ones;
+        removing the dependent rows keeps those new records from inheriting them.
+        :param accessions: Experiment accessions.
+        """
+        accessions = list(accessions)
+        if len(accessions) == 0:
+            return
+        tables = self.get_tables()
+        with self.__connection.cursor() as cursor:
+            cursor.execute("""select experiment_package_id from experiment_package_experiment 
+            where accession = any(%s)""", (accessions,))
+            ids = {'experiment_package': [internal_id for internal_id, in cursor.fetchall()]}
+            # percorrendo as referências a partir de experiment_package, pais antes dos filhos
+            order = ['experiment_package']
+            for table in order:
+                for child in sorted(tables):
+                    if tables[child]['reference'] == table and child not in ids:
+                        cursor.execute(f'select internal_id from "{child}" where {table}_id = any(%s)', (ids[table],))
+                        ids[child] = [internal_id for internal_id, in cursor.fetchall()]
+                        order.append(child)
+            cursor.execute("""select table_name from information_schema.tables where table_schema = %s""",
+                           (self.__schema,))
+            mining_tables = {table_name for table_name, in cursor.fetchall()}
+            # accessions das linhas consolidadas, lidas antes de remover os registros referenciados
+            consolidated = {}
+            for table, reference in self.mining_references.items():
+                if table in mining_tables and reference['reference_table'] in ids:
+                    cursor.execute(f"""select distinct {reference['reference_column']} 
+                    from "{reference['reference_table']}" where internal_id = any(%s)""",
+                                   (ids[reference['reference_table']],))
+                    consolidated[table] = [value for value, in cursor.fetchall()]
+            for table in reversed(order):
+                cursor.execute(f'delete from "{table}" where internal_id = any(%s)', (ids[table],))
+            if self.__record_accessions_exist(cursor):
+                cursor.execute("""delete from record_accession where experiment_package_id = any(%s)""",
+                               (ids['experiment_package'],))
+            # anotações e termos dos registros removidos, que seriam herdados pelos novos registros com o mesmo ID
+            for mining_table in ('table_annotation', 'annotation_entity', 'sample_mining_terms'):
+                if mining_table in mining_tables:
+                    for table in order:
+                        cursor.execute(f"""delete from {self.__schema}.{mining_table} 
+                        where schema_name = 'public' and table_name = %s and internal_id = any(%s)""",
+                                       (table, ids[table]))
+            for table, values in consolidated.items():
+                cursor.execute(f"""delete from {self.__schema}.{table} 
+                where {self.mining_references[table]['column']} = any(%s)""", (values,))
+            # shards com registros removidos não podem mais ser reinseridos e suas faixas de IDs são liberadas
+            cursor.execute("""select to_regclass('public.xml_shard')""")
+            if cursor.fetchone()[0] is not None:
+                cursor.execute("""delete from xml_shard where (run, file) in (
+                    select run, file from xml_shard 
+                    where table_name = 'experiment_package' and exists (
+                        select 1 from unnest(%s::bigint[]) as deleted(internal_id) 
+                        where deleted.internal_id between first_id and last_id
+                    )
+                )""", (ids['experiment_package'],))
+            self.__connection.commit()
+        self.invalidate_schema_cache()
+        logging.info(f'{len(ids["experiment_package"])} experiment packages deleted.')
+
+    def __last_internal_ids(self, entities):
+        last_ids = {}
+        with self.__connection.cursor() as cursor:
+            cursor.execute("""select table_name from information_schema.columns 
+            where table_schema = 'public' and column_name = 'internal_id'""")
+            tables = {table_name for table_name, in cursor.fetchall()}
+            for entity in entities:
+                if self.get_short_name(entity) in tables:
+                    cursor.execute(f'select coalesce(max(internal_id), 0) from "{self.get_short_name(entity)}"')
+                    last_ids[entity] = cursor.fetchone()[0]
+        return last_ids
+
+    def reinsert_xml_shard(self, xml, shard):
+        """
+        Delete the rows of a shard and insert them again, keeping the internal IDs assigned to it by create_from_xml.
+        When the directory was ingested more than once (incremental downloads reuse the page names), the last
+        ingestion of the file is used, and the file must still have the number of elements it had then.
+        :param xml: Directory of shards used by create_from_xml.
+        :param shard: File name of the shard.
+        """
+        entities = {}
+        references = {}
+        start_node = 'EXPERIMENT_PACKAGE'
+        shards = XML.list_shards(xml)
+        element_counts = self.__generate_shards_structure(shards, entities, references, None, start_node)
+        shard = path.join(xml, path.basename(shard))
+        if shard not in shards:
+            raise ValueError(f'Shard {shard} not found.')
+        with self.__connection.cursor() as cursor:
+            # a ingestão mais recente do arquivo, que é a que está no diretório
+            cursor.execute("""select table_name, first_id, last_id from xml_shard 
+            where run = (
+                select run from xml_shard where directory = %s and file = %s order by created desc limit 1
+            ) and file = %s""", (path.realpath(xml), path.basename(shard), path.basename(shard)))
+            ranges = {table_name: (first_id, last_id) for table_name, first_id, last_id in cursor.fetchall()}
+            if len(ranges) == 0:
+                raise ValueError(f'Shard {shard} was not inserted by create_from_xml.')
+            # o arquivo pode ter sido substituído por um download posterior que não foi inserido
+            counts = {self.get_short_name(name): count for name, count in element_counts[shards.index(shard)].items()
+                      if name in entities}
+            if counts != {table_name: last_id - first_id + 1 for table_name, (first_id, last_id) in ranges.items()}:
+                raise ValueError(f'Shard {shard} does not match the internal IDs assigned to it by create_from_xml.')
+            # removendo as tabelas filhas antes das tabelas referenciadas
+            for entity in sorted(entities, key=lambda name: self.__reference_depth(name, references), reverse=True):
+                table_name = self.get_short_name(entity)
+                if table_name in ranges:
+                    cursor.execute(f'DELETE FROM "{table_name}" WHERE internal_id BETWEEN %s AND %s',
+                                   ranges[table_name])
+            if self.__record_accessions_exist(cursor):
+                for table_name, (first_id, last_id) in ranges.items():
+                    cursor.execute("""delete from record_accession
+                    where table_name = %s and internal_id between %s and %s""", (table_name, first_id, last_id))
+            self.__connection.commit()
+        last_ids = {entity: ranges[self.get_short_name(entity)][0] - 1 for entity in entities
+                    if self.get_short_name(entity) in ranges}
+        self.insert_from_xml_shard(shard, entities, references, last_ids, start_node)
+        self.update_record_accessions()
+
+    def insert_from_xml_shard(self, shard, entities, references, last_ids, start_node=None, batch_size=None) -> int:
+        """
+        Insert a shard, numbering the rows of each table after the IDs in last_ids.
+        :param shard: XML file.
+        :param entities: Entities generated by XML.generate_structure.
+        :param references: References generated by XML.generate_structure.
+        :param last_ids: Last internal ID already used by each table (element path).
+        :param start_node: Tag of the records.
+        :param batch_size: Rows written by transaction.
+        :return: Number of inserted rows.
+        """
+        with open_file(shard) as xml_file:
+            data = etree.parse(xml_file, etree.XMLParser(remove_blank_text=True, remove_comments=True))
+        return self.insert_from_xml(data.getroot(), entities, references, {}, last_ids=dict(last_ids),
+                                    start_node=start_node, batch_size=batch_size)
+
+    @staticmethod
+    def __generate_shards_structure(shards, entities, references, paths, start_node):
+        element_counts = []
+        with StatusBar('Analyzing XML shards', len(shards)) as status_bar:
+            for shard in shards:
+                element_counts.append(Counter())
+                with open_file(shard) as xml_file:
+                    XML.generate_structure_from_file(xml_file, entities, references, paths, start_node=start_node,
+                                                     counts=element_counts[-1])
+                status_bar.update()
+        return element_counts
+
+    def __insert_shards(self, shards, element_counts, entities, references, start_node, workers=None,
+                        last_ids=None, batch_size=None):
+        # cada shard recebe uma faixa de internal_id por tabela, contínua com a do shard anterior
+        allocator = IdAllocator(last_ids)
+        shard_ranges = [allocator.allocate(element_count) for element_count in element_counts]
+        # downloads incrementais repetem os nomes das páginas, então as faixas são registradas por ingestão (run)
+        run = uuid4().hex
+        with self.__connection.cursor() as cursor:
+            cursor.execute(f"""CREATE TABLE IF NOT EXISTS xml_shard(
+                run text,
+                directory text,
+                file text,
+                table_name text,
+                first_id bigint,
+                last_id bigint,
+                created timestamp default now(),
+                primary key (run, file, table_name)
+            );""")
+            for shard, first_ids, element_count in zip(shards, shard_ranges, element_counts):
+                for name, count in element_count.items():
+                    if name in entities:
+                        cursor.execute(
+                            """insert into xml_shard(run, directory, file, table_name, first_id, last_id) 
+                            values (%s, %s, %s, %s, %s, %s)""",
+                            (run, path.realpath(path.dirname(shard)), path.basename(shard), self.get_short_name(name),
+                             first_ids.get(name, 0) + 1, first_ids.get(name, 0) + count)
+                        )
+            # faixas de ingestões anteriores ainda registradas têm registros vivos e não podem ser sobrepostas
+            cursor.execute("""select new.file, new.table_name, previous.file from xml_shard new
+            join xml_shard previous on previous.table_name = new.table_name and previous.run <> new.run
+                and previous.first_id <= new.last_id and new.first_id <= previous.last_id
+            where new.run = %s limit 1""", (run,))
+            overlap = cursor.fetchone()
+            if overlap is not None:
+                self.__connection.rollback()
+                raise ValueError(f'Internal IDs of {overlap[1]} in shard {overlap[0]} overlap the ones of shard '
+                                 f'{overlap[2]} of a previous ingestion.')
+        self.__connection.commit()
+        worker_rows = Counter()
+        with StatusBar('Inserting XML shards', len(shards)) as status_bar:
+            with ProcessPoolExecutor(max_workers=workers or cpu_count(), initializer=initialize_worker,
+                                     initargs=(self.__arguments(), entities, references)) as executor:
+                futures = {executor.submit(insert_xml_shard, shard, first_ids, start_node, batch_size): shard
+                           for shard, first_ids in zip(shards, shard_ranges)}
+                for future in as_completed(futures):
+                    worker, rows = future.result()
+                    logging.info(f'Shard {path.basename(futures[future])}: {rows} rows inserted.')
+                    worker_rows[worker] += rows
+                    status_bar.update()
+        self.__log_worker_rows(worker_rows)
+        return sum(worker_rows.values())
+
+    @staticmethod
+    def __reference_depth(entity, references):
+        depth = 0
+        while entity in references:
+            entity = references[entity]
+            depth += 1
+        return depth
+
+    def __arguments(self):
+        # parâmetros para abrir uma nova instância (e conexão) em outro processo
+        return dict(database=self.__database, host=self.__parameters['host'], user=self.__parameters.get('user'),
+                    password=self.__parameters.get('password'), port=self.__parameters.get('port'),
+                    dbms=self.__dbms, schema=self.__schema, pool_timeout=self.__pool_timeout,
+                    itersize=self.__itersize)
+
+    def detect_data(self, cache: bool = False, workers: int = None, block_size: int = 500):
+        """
+        Detect the unstructured fields and annotate their entities (table_annotation and annotation_entity).
+        :param cache: Reuse the Mining instance of a previous call, when annotating in this process.
+        :param workers: Annotation processes, each one loading Mining once. Default is the number of CPUs; with 1 the
+        records are annotated in this process.
+        :param block_size: Records sent to an annotation process at a time.
+        """
         logging.info('Search for unstructured data...')
-        if cache:
-            if self.mining is None:
+        workers = workers or cpu_count()
+        if workers == 1:
+            if cache:
+                if self.mining is None:
+                    self.mining = Mining()
+            else:
                 self.mining = Mining()
-        else:
-            self.mining = Mining()
         tables = self.get_tables_columns(show_type=True, data_mining_tables=True)
 
         with StatusBar('Searching for data types', len(tables)) as status_bar:
@@ -934,15 +1397,11 @@ class Database:
                 self.insert_table_unstructured_fields(tables[table]['schema'], table, unstructured_columns)
                 status_bar.update()
 
-        # TODO: rever esta estratégia de sobrescrever a função. Pode ser perigoso.
-        global get_pos_tag
-
-        def get_pos_tag(_text, _internal_id, _mining):
-            temp = _mining.get_pos_tag(_text, entity=True)
-            return _internal_id, temp
-
-        with StatusBar('Processing unstructured data', len(unstructured_tables)) as status_bar:
-            with self.__connection.cursor() as cursor, self.__connection_2.cursor() as cursor_2:
+        # processos de anotação: cada um carrega Mining uma vez e recebe os registros em blocos
+        with StatusBar('Processing unstructured data', len(unstructured_tables)) as status_bar, \
+                (ProcessPoolExecutor(max_workers=workers, initializer=initialize_annotation_worker)
+                 if workers > 1 else nullcontext()) as executor:
+            with self.__connection_2.cursor() as cursor_2:
                 cursor_2.execute(f"""
                 create temporary table temp_table_annotation
                 (
@@ -950,7 +1409,7 @@ class Database:
                     table_name  text not null,
                     column_name text not null,
                     internal_id bigint       not null,
-                    tree        text
+                    entities    jsonb
                 );
 
                 """)
@@ -966,72 +1425,65 @@ class Database:
                                 where {column} is not null"""
                             if self.__limit_record_number:
                                 query += f" order by random() limit {self.__limit_record_number}"
-                            cursor.execute(query)
-                            detect_count = 0
-                            with NamedTemporaryFile() as tempfile:
-                                sep = '<===>'
-                                with open(tempfile.name, 'w') as file:
-                                    for record in self.__unpack_results(cursor):
-                                        new_line = '\n'
-                                        file.write(
-                                            f'{sep.join([str(i).replace(new_line, " ").strip() for i in record])}\n')
-                                with (ThreadPoolExecutor(max_workers=cpu_count()) as executor):
-                                    futures = []
-                                    with open(tempfile.name, 'r') as file:
-                                        for record in file:
-                                            internal_id, text = record.split(sep)
-                                            internal_id = int(internal_id)
-                                            future = executor.submit(get_pos_tag, text, internal_id, self.mining)
-                                            futures.append(future)
-                                        errs = []
-                                        for future in as_completed(futures):
-                                            if future.exception():
-                                                errs.append(str(future.exception()))
-                                            else:
-                                                internal_id, tree = future.result()
-                                                save = False
-                                                for t in tree:
-                                                    if save:
-                                                        break
-                                                    for j in t:
-                                                        if isinstance(j, Tree):
-                                                            save = True
-                                                            break
-                                                if save:
-                                                    cursor_2.execute(
-                                                        f"""
-                                                                    insert into temp_table_annotation(schema_name, table_name, column_name, internal_id, tree)
-                                                                    values(%s, %s, %s, %s, %s);""",
-                                                        (unstructured_tables[table]['schema'], table, column,
-                                                         internal_id, str(tree))
-                                                    )
-                                                    detect_count += 1
-                                        if len(errs) > 0:
-                                            errs = '\n'.join(errs)
-                                            logging.error(f'{len(errs)} errs detected on processing table {table}.')
-                                            logging.error(f'{errs}')
-                                        if detect_count > 0:
-                                            self.__connection.commit()
+                            errs = []
+                            with self.__server_cursor() as cursor, \
+                                    self.__batch_writer(self.__connection_2) as writer:
+                                cursor.execute(query)
+                                futures = deque()
+                                while len(records := cursor.fetchmany(block_size)) > 0:
+                                    records = [(internal_id, str(text).replace('\n', ' ').strip())
+                                               for internal_id, text in records]
+                                    if executor is None:
+                                        results = annotate_records(records, self.mining)
+                                        self.__write_annotations(writer, table, column, results, errs)
+                                        continue
+                                    futures.append(executor.submit(annotate_records, records))
+                                    # limitando os blocos em memória; os resultados são gravados à medida que chegam
+                                    while len(futures) >= workers * 2:
+                                        self.__write_annotations(writer, table, column, futures.popleft().result(),
+                                                                 errs)
+                                while len(futures) > 0:
+                                    self.__write_annotations(writer, table, column, futures.popleft().result(), errs)
+                            if len(errs) > 0:
+                                logging.error(f'{len(errs)} errs detected on processing table {table}.')
+                                logging.error('\n'.join(errs))
+                            # as entidades das novas anotações são gravadas uma única vez em annotation_entity
                             cursor_2.execute(f"""
-                            insert into {annotated_table}(schema_name, table_name, column_name, internal_id, tree)
-                            select tt.schema_name, tt.table_name, tt.column_name, tt.internal_id, tt.tree
+                            with annotation as (
+                            insert into {annotated_table}(schema_name, table_name, column_name, internal_id, entities)
+                            select tt.schema_name, tt.table_name, tt.column_name, tt.internal_id, tt.entities
                             from temp_table_annotation tt
                             left join {annotated_table} at 
                                 on tt.schema_name = at.schema_name
                                 and tt.table_name = at.table_name
                                 and tt.column_name = at.column_name
                                 and tt.internal_id = at.internal_id
-                                and tt.tree = at.tree
+                                and tt.entities = at.entities
                             where 
                                 at.schema_name is null
                                 and at.table_name is null
                                 and at.column_name is null
                                 and at.internal_id is null
-                                and at.tree is null
+                                and at.entities is null
+                            returning schema_name, table_name, column_name, internal_id, entities
+                            )
+                            {self.__annotation_entity_insert('annotation')}
                             """)
+                            cursor_2.execute(f"""truncate temp_table_annotation""")
                             self.__connection_2.commit()
                     status_bar.update()
 
+    @staticmethod
+    def __write_annotations(writer, table, column, results, errs):
+        # anotações de um bloco de registros
+        for internal_id, annotation, err in results:
+            if err is not None:
+                errs.append(err)
+            else:
+                writer.add('temp_table_annotation',
+                           ('schema_name', 'table_name', 'column_name', 'internal_id', 'entities'),
+                           ('public', table, column, internal_id, annotation))
+
     def extract_groups(self, output_dir):
         if self.mining is None:
             self.mining = Mining()
@@ -1093,12 +1545,12 @@ class Database:
         logging.info(f'Processing pair attributes...')
         # TODO: incluir esses resultados no banco de dados
         # TODO: incluir outros consolidados no processamento
-        with self.__connection.cursor() as cursor:
+        with self.__server_cursor() as cursor:
             query = f"""select * from {self.__schema}.consolidated_sample"""  # TODO: incluir outras tabelas consolidadas, recuperar accession
             if self.__limit_record_number:
                 query += f" order by random() limit {self.__limit_record_number}"
             cursor.execute(query)
-            columns = [i.name for i in cursor.description]
+            columns = self.__column_names(cursor)
             temp = [i.replace('_', ' ') for i in columns]
 
             def get_synonyms(_query, _subject):
@@ -1133,7 +1585,7 @@ class Database:
             dataframe = pd.concat((dataframe, temp), axis=1)
             del temp
             with StatusBar(task_name=f'Working on pair fields',
-                           size=cursor.rowcount) as status_bar:  # TODO: implementar tag values já processados no banco
+                           size=self.__estimate_rows(query)) as status_bar:  # TODO: implementar tag values já processados no banco
                 for record in self.__unpack_results(cursor):
                     record = dict(zip(columns, record))
                     for column in record:
@@ -1195,22 +1647,14 @@ class Database:
                         if self.__limit_record_number:
                             query += f" order by random() limit {self.__limit_record_number}"
                         parameters = (f"{sub_pair_field['field_sub_a']}%{sub_pair_field['field_sub_b']}",)
-                        with self.__connection_2.cursor() as cursor_2:
+                        with self.__server_cursor(self.__connection_2) as cursor_2:
                             cursor_2.execute(query, parameters)
-                            for internal_id, value, in self.__unpack_results(cursor_2):
-                                related_data = self.get_table_related_data(
-                                    table=sub_pair_field['table'],
-                                    reference_table='experiment_package_sample',
-                                    table_internal_id=internal_id
-                                )
-                                accession = None
-                                for i in related_data:
-                                    if accession is None:
-                                        accession = i['experiment_package_sample_accession']
-                                    elif accession != i['experiment_package_sample_accession']:
-                                        logging.warning(f"More then one accession detected for record {accession}."
-                                                        f" New: {i['experiment_package_sample_accession']}")
-                                sub_dataframes[sub_pair_field['table']].at[accession, name] = value
+                            # accessions resolvidos por bloco de registros
+                            while len(rows := cursor_2.fetchmany(self.__chunk_size)) > 0:
+                                accessions = self.get_sample_accessions(sub_pair_field['table'],
+                                                                        [internal_id for internal_id, _ in rows])
+                                for internal_id, value, in rows:
+                                    sub_dataframes[sub_pair_field['table']].at[accessions.get(internal_id), name] = value
                 status_bar.update()
 
         logging.info(f'Writing csv file...')
@@ -1221,54 +1665,30 @@ class Database:
         dataframe.to_csv(path.join(output_dir, f'sample_caracteristics.csv'), index_label='sample_accession')
 
         logging.info(f'Processing unstructured fields...')
-        with self.__connection_2.cursor() as cursor_2:
+        self.update_annotation_entities()
+        with self.__server_cursor(self.__connection_2) as cursor_2:
             query = f"""
-            select schema_name, table_name, column_name, internal_id, tree
-            from {self.__schema}.table_annotation
+            select annotation_entity.schema_name, annotation_entity.table_name, annotation_entity.column_name,
+                annotation_entity.internal_id, annotation_entity.label, annotation_entity.term
+            {self.__annotation_entity_source()}
             """
-            if self.__limit_record_number:
-                query += f' order by random() limit {self.__limit_record_number}'
             cursor_2.execute(query)
 
-            with StatusBar(task_name=f'Working on unstructured fields', size=cursor_2.rowcount) as status_bar:
-                for schema_name, table_name, column_name, internal_id, tree in self.__unpack_results(cursor_2):
-                    if schema_name != self.__schema:
-                        related_data = self.get_table_related_data(
-                            table=table_name,
-                            reference_table='experiment_package_sample',
-                            table_internal_id=internal_id
-                        )
-                        accession = None
-                        for i in related_data:
-                            if accession is None:
-                                accession = i['experiment_package_sample_accession']
-                            elif accession != i['experiment_package_sample_accession']:
-                                logging.warning(f"More then one accession detected for record {accession}."
-                                                f" New: {i['experiment_package_sample_accession']}")
-                    else:
-                        query = f"""
-                        select accession
-                        from {schema_name}.{table_name}
-                        where internal_id = %s
-                        """
-                        cursor_2.execute(query, (internal_id,))
-                        accession, = cursor_2.fetchone()
-                    trees = eval(tree)
-                    for i, value in enumerate(trees):  # TODO: pensar na importância de se usar a posição da frase
-                        for entity in Mining.get_entities_from_tree(value):
-                            column = (f'{entity.label.replace(" ", "_")}_{column_name}__'
-                                      f'{format_name(" ".join([i[0] for i in entity.leaves]))}')
-                            if column not in dataframe:
-                                temp = {column: {}}
-                                temp = pd.DataFrame(temp)
-                                temp = temp.astype(str)
-                                dataframe = pd.concat((dataframe, temp), axis=1)
-                            dataframe.at[accession, column] = True
-                    status_bar.update()
+            with StatusBar(task_name=f'Working on unstructured fields',
+                           size=self.__estimate_rows(query)) as status_bar:
+                rows = []
+                for row in self.__unpack_results(cursor_2):
+                    rows.append(row)
+                    if len(rows) < self.__chunk_size:
+                        continue
+                    dataframe = self.__add_unstructured_fields(dataframe, rows, status_bar)
+                    rows = []
+                dataframe = self.__add_unstructured_fields(dataframe, rows, status_bar)
 
         logging.info(f'Writing csv file...')
 
         dataframe = dataframe.replace(r'^\s*$', None, regex=True)
+
         dataframe = dataframe.replace(r'^na$', None, regex=True)
         dataframe = dataframe.replace(r'^none$', None, regex=True)
         dataframe = dataframe.replace(r'^null$', None, regex=True)
@@ -1323,6 +1743,26 @@ class Database:
             dataframe.insert(0, 'cluster', clusters)
             dataframe.to_csv(path.join(output_dir, f'sample_caracteristics_groups.csv'), index=False)
 
+    def __add_unstructured_fields(self, dataframe, rows, status_bar):
+        # entidades de um bloco de linhas de annotation_entity, com os accessions resolvidos por tabela
+        ids = {}
+        for schema_name, table_name, column_name, internal_id, label, term in rows:
+            ids.setdefault((schema_name, table_name), []).append(internal_id)
+        accessions = {(schema_name, table_name): self.get_sample_accessions(table_name, internal_ids, schema_name)
+                      for (schema_name, table_name), internal_ids in ids.items()}
+        for schema_name, table_name, column_name, internal_id, label, term in rows:
+            accession = accessions[(schema_name, table_name)].get(internal_id)
+            # TODO: pensar na importância de se usar a posição da frase
+            column = f'{label.replace(" ", "_")}_{column_name}__{format_name(term)}'
+            if column not in dataframe:
+                temp = {column: {}}
+                temp = pd.DataFrame(temp)
+                temp = temp.astype(str)
+                dataframe = pd.concat((dataframe, temp), axis=1)
+            dataframe.at[accession, column] = True
+            status_bar.update()
+        return dataframe
+
     def get_database_name(self):
         return self.__database
 
@@ -1450,105 +1890,157 @@ class Database:
                     columns[column].add(format_name(mesh_term['mesh_term']))
         return columns
 
-    def get_mining_terms(self):
-        """Recupera as anotações por amostras mineradas de texto não estruturado."""
-        with self.__connection.cursor() as cursor, self.__connection.cursor() as cursor_2:
-            # criando tabela temporária para armazenar dados
-            reference_table = 'experiment_package_sample'
-            temporary_table = f'temp_mesh_terms'
-
-            cursor.execute(f"""create temporary table {temporary_table}_ids (
-                schema_name text,
-                table_name text,
-                column_name text,
-                internal_id bigint,
-                sample_accession text
-            )""")
-
-            cursor.execute(f"""create temporary table {temporary_table} (
-                schema_name text,
-                table_name text,
-                column_name text,
-                internal_id bigint,
-                category text,
-                term text,
-                sample_accession text
-            )""")
-
+    def migrate_table_annotation(self) -> int:
+        """
+        Convert the annotations stored by previous versions as the str() of NLTK trees (column tree) to the JSON format
+        of Mining.get_annotation (column entities), parsing the trees without eval. The tree of the converted rows is
+        cleared. Rows already converted are skipped, so it can run at any time.
+        :return: Number of converted rows.
+        """
+        with self.__connection.cursor() as cursor:
+            cursor.execute(f"""select to_regclass('{self.__schema}.table_annotation')""")
+            if cursor.fetchone()[0] is None:
+                return 0
+            cursor.execute(f"""alter table {self.__schema}.table_annotation add column if not exists entities jsonb""")
+            self.__connection.commit()
             query = f"""
-            select schema_name, table_name, column_name, internal_id, tree
+            select ctid, tree
             from {self.__schema}.table_annotation
+            where entities is null and tree is not null
             """
-            if self.__limit_record_number:
-                query += f' order by random() limit {self.__limit_record_number}'
-
-            cursor.execute(query)
-
-            with StatusBar('Querying Mesh term trees...', cursor.rowcount) as status_bar:
-                for schema_name, table_name, column_name, internal_id, trees in self.__unpack_results(cursor):
-                    trees = eval(trees)
-                    for tree in trees:
-                        for entity in Mining.get_entities_from_tree(tree):
-                            term = ' '.join([i[0] for i in entity.leaves])
-                            cursor_2.execute(f"""insert into {temporary_table} (
-                            schema_name, table_name, column_name, internal_id, category, term) values (%s, %s, %s, %s, %s, %s);""",
-                                             (
-                                                 schema_name,
-                                                 table_name,
-                                                 column_name,
-                                                 internal_id,
-                                                 entity.label.lower(),
-                                                 term.lower()))
+            cursor.execute(f"""select exists({query})""")
+            if not cursor.fetchone()[0]:
+                return 0
+            size = self.__estimate_rows(query)
+            temporary_table = 'temp_annotation_migration'
+            cursor.execute(f"""create temporary table {temporary_table} (row_id tid, entities jsonb)""")
+            with StatusBar('Converting annotation trees...', size) as status_bar, \
+                    self.__server_cursor() as cursor_trees, self.__batch_writer() as writer:
+                cursor_trees.execute(query)
+                for row_id, tree in self.__unpack_results(cursor_trees):
+                    try:
+                        annotation = Mining.get_annotation(Mining.parse_trees(tree))
+                    except (SyntaxError, ValueError) as err:
+                        logging.warning(f'{err}. Annotation tree at {row_id} not converted.')
+                    else:
+                        writer.add(temporary_table, ('row_id', 'entities'), (row_id, json.dumps(annotation)))
                     status_bar.update()
-            cursor_2.execute(f"""select 
-                schema_name, table_name, column_name, array_agg(distinct(internal_id)) as internal_ids 
+            cursor.execute(f"""
+            update {self.__schema}.table_annotation
+            set entities = {temporary_table}.entities, tree = null
             from {temporary_table}
-            group by schema_name, table_name, column_name;""")
-            with StatusBar('Recovering accession numbers...', cursor_2.rowcount) as status_bar:
-                query = f"""insert into {temporary_table}_ids (schema_name, table_name, column_name, internal_id, 
-                sample_accession) values (%s, %s, %s, %s, %s);"""
-                for schema_name, table_name, column_name, internal_ids in self.__unpack_results(cursor_2):
-                    for sample in self.get_table_related_data(
-                            table=table_name, table_internal_id=internal_ids,
-                            reference_table=reference_table):
-                        cursor.execute(query, (
-                            schema_name,
-                            table_name,
-                            column_name,
-                            sample[f'{table_name}_internal_id'],
-                            sample[f'{reference_table}_accession']
-                        ))
-                    status_bar.update()
+            where table_annotation.ctid = {temporary_table}.row_id
+            """)
+            converted = cursor.rowcount
+            cursor.execute(f"""drop table {temporary_table}""")
+            self.__connection.commit()
+        logging.info(f'{converted} annotation trees converted.')
+        return converted
 
-            with StatusBar('Writing accession numbers...', 1) as status_bar:
-                cursor.execute(f"""
-                update {temporary_table}
-                set sample_accession = accessions.sample_accession
-                from (
-                    select 
-                        schema_name, table_name, column_name, internal_id, sample_accession
-                    from {temporary_table}_ids
-                    group by schema_name, table_name, column_name, internal_id, sample_accession
-                ) as accessions
-                where {temporary_table}.schema_name = accessions.schema_name 
-                    and {temporary_table}.table_name = accessions.table_name
-                    and {temporary_table}.column_name = accessions.column_name 
-                    and {temporary_table}.internal_id = accessions.internal_id
-                """)
+    def get_mining_terms(self):
+        """Recupera as anotações por amostras mineradas de texto não estruturado."""
+        query = self.__mining_terms_query()
+        with StatusBar('Recovering Mesh Terms...', self.__estimate_rows(query)) as status_bar, \
+                self.__server_cursor() as cursor_terms:
+            cursor_terms.execute(query)
+            for (schema_name, table_name, column_name, internal_id, category, mesh_term, term,
+                 sample_accession) in self.__unpack_results(cursor_terms):
+                yield dict(schema_name=schema_name, table_name=table_name, column_name=column_name,
+                           internal_id=internal_id, category=category, mesh_term=mesh_term, term=term,
+                           sample_accession=sample_accession)
                 status_bar.update()
 
-            cursor.execute(f"""select schema_name, table_name, column_name, internal_id, category, term, 
-            sample_accession from {temporary_table};""")
-            with StatusBar('Recovering Mesh Terms...', cursor.rowcount) as status_bar:
-                for (schema_name, table_name, column_name, internal_id, category, term,
-                     sample_accession) in self.__unpack_results(cursor):
-                    category = [i.strip() for i in category.split(':')]
-                    mesh_term = category[1]
-                    category = category[0]
-                    yield dict(schema_name=schema_name, table_name=table_name, column_name=column_name,
-                               internal_id=internal_id, category=category, mesh_term=mesh_term, term=term,
-                               sample_accession=sample_accession)
-                    status_bar.update()
+    def __mining_terms_query(self):
+        # entidades anotadas com o accession da amostra de cada registro
+        self.update_annotation_entities()
+        self.update_record_accessions()
+        return f"""
+        select annotation_entity.schema_name, annotation_entity.table_name, annotation_entity.column_name,
+            annotation_entity.internal_id, annotation_entity.category, annotation_entity.mesh_term,
+            annotation_entity.term, record_accession.sample_accession
+        {self.__annotation_entity_source()}
+        left join record_accession on annotation_entity.schema_name = 'public'
+            and record_accession.table_name = annotation_entity.table_name
+            and record_accession.internal_id = annotation_entity.internal_id
+        """
+
+    def update_annotation_entities(self):
+        """
+        Create the annotation_entity table, with one row by entity of table_annotation, and add the entities of the
+        annotations not in it yet (annotations of previous versions, converted by migrate_table_annotation). detect_data
+        adds the entities of new annotations as it writes them.
+        """
+        self.migrate_table_annotation()
+        with self.__connection.cursor() as cursor:
+            cursor.execute(f"""select to_regclass('{self.__schema}.table_annotation')""")
+            if cursor.fetchone()[0] is None:
+                return
+            cursor.execute(f"""
+            create table if not exists {self.__schema}.annotation_entity (
+                schema_name text not null,
+                table_name text not null,
+                column_name text not null,
+                internal_id bigint not null,
+                sentence_idx integer not null,
+                label text not null,
+                term text,
+                mesh_term text,
+                category text
+            )""")
+            cursor.execute(f"""create index if not exists annotation_entity_category
+            on {self.__schema}.annotation_entity (category, mesh_term)""")
+            cursor.execute(f"""create index if not exists annotation_entity_record
+            on {self.__schema}.annotation_entity (table_name, internal_id)""")
+            self.__connection.commit()
+            cursor.execute(f"""
+            with annotation as (
+                select schema_name, table_name, column_name, internal_id, entities
+                from {self.__schema}.table_annotation
+                where entities is not null and not exists (
+                    select 1 from {self.__schema}.annotation_entity
+                    where annotation_entity.table_name = table_annotation.table_name
+                        and annotation_entity.internal_id = table_annotation.internal_id
+                        and annotation_entity.schema_name = table_annotation.schema_name
+                        and annotation_entity.column_name = table_annotation.column_name
+                )
+            )
+            {self.__annotation_entity_insert('annotation')}
+            """)
+            if cursor.rowcount > 0:
+                logging.info(f'{cursor.rowcount} annotation entities added.')
+                cursor.execute(f"""analyze {self.__schema}.annotation_entity""")
+            self.__connection.commit()
+
+    def __annotation_entity_insert(self, annotation):
+        # uma linha por span das anotações (schema_name, table_name, column_name, internal_id, entities) de annotation;
+        # o rótulo tem a forma "categoria: termo MeSH"
+        return f"""
+        insert into {self.__schema}.annotation_entity (
+            schema_name, table_name, column_name, internal_id, sentence_idx, label, term, mesh_term, category)
+        select annotation.schema_name, annotation.table_name, annotation.column_name, annotation.internal_id,
+            (span->>0)::integer, span->>1,
+            lower((select string_agg(token, ' ' order by position)
+                   from jsonb_array_elements_text(span->4) with ordinality as tokens(token, position))),
+            trim(split_part(lower(span->>1), ':', 2)), trim(split_part(lower(span->>1), ':', 1))
+        from {annotation} as annotation
+        cross join lateral jsonb_array_elements(annotation.entities->'spans') as span
+        where annotation.entities->>'version' = '{Mining.annotation_version}'
+        """
+
+    def __annotation_entity_source(self):
+        # cláusula from de annotation_entity; com limit_record_number, apenas as entidades de anotações sorteadas, em uma
+        # subconsulta para que junções possam vir em seguida
+        if not self.__limit_record_number:
+            return f"""from {self.__schema}.annotation_entity"""
+        return f"""from (
+            select *
+            from {self.__schema}.annotation_entity
+            where (schema_name, table_name, column_name, internal_id) in (
+                select schema_name, table_name, column_name, internal_id
+                from {self.__schema}.table_annotation
+                order by random() limit {self.__limit_record_number}
+            )
+        ) as annotation_entity"""
 
     def get_mining_related_data(self, consolidated_table, referenced_table, table_columns_filter: list | set = None,
                                 max_rows: int = None):  # TODO: verificar max_rows. Não está implementado.
@@ -2000,11 +2492,14 @@ class Database:
                     dataframe_consolidado.to_sql(name=f'consolidated_{table_name}', con=connection,
                                                  schema=self.__schema, if_exists='replace', index=True,
                                                  index_label='accession', chunksize=self.__chunk_size)
+                engine.dispose()
             try:
                 dataframe_consolidado.to_excel(path.join(output_dir, f'consolidated_{table_name}.xlsx'))
             except Exception as err:
                 logging.error(err)
                 logging.error(f'table: {table_name}, sheet: consolidated')
+        # tabelas consolidadas criadas ou substituídas por to_sql
+        self.invalidate_schema_cache()
 
     def get_query(self, table):
         tables = self.get_tables_columns()
@@ -2047,24 +2542,7 @@ class Database:
         return temp_name
 
     def get_tables(self):
-        with self.__connection.cursor() as cursor:
-            query = f"""select
-                id,
-                name,
-                reference
-            from
-                table_name
-            order by name"""
-            cursor.execute(query)
-            tables = {}
-            for _id, name, reference in self.__unpack_results(cursor):
-                tables[_id] = {'name': name, 'reference': reference}
-            for _id in tables:
-                if tables[_id]['reference'] in tables:
-                    tables[_id]['reference_name'] = tables[tables[_id]['reference']]['name']
-                else:
-                    tables[_id]['reference_name'] = tables[_id]['reference']
-            return tables
+        return deepcopy(self.__get_catalog()['tables'])
 
     def get_table_data(self, schema, table, columns: list = None, column_key_field: str = None):
         with self.__connection.cursor() as cursor:
@@ -2088,66 +2566,139 @@ class Database:
                     yield row
 
     def get_tables_columns(self, table_name: str = None, show_type: bool = False, data_mining_tables=False):
-        with self.__connection.cursor() as cursor:
-            parameters = [self.__database]
-            query = f"""select columns.table_schema, columns.table_name as id, table_name.name,
-                "columns".column_name, "columns".data_type
-            from information_schema."columns"
-            join public.table_name on public.table_name.id = "columns".table_name
-            where columns.table_catalog = %s
-                and columns.table_schema = 'public'"""
-            if table_name is not None:
-                query += """ and columns.table_name = %s"""
-                parameters.append(table_name)
-            if data_mining_tables:
-                query += f"""
-                union
-                select columns.table_schema, "columns".table_name as id, "columns".table_name as name, 
-                    "columns".column_name, "columns".data_type
-                from information_schema."columns"
-                where columns.table_catalog = %s
-                    and columns.table_schema = '{self.__schema}'
-                """
-                parameters.append(self.__database)
-            query += """ order by name, column_name;"""
-            cursor.execute(query, parameters)
-            tables = {}
-            for schema_name, _id, name, column_name, data_type in self.__unpack_results(cursor):
-                if schema_name == self.__schema:
-                    if not _id.startswith('consolidated_'):
-                        continue
-                if show_type:
-                    column = {'name': column_name, 'data_type': data_type, 'structured': True}
-                else:
-                    column = column_name
-                if _id not in tables:
-                    tables[_id] = {'schema': schema_name, 'name': name, 'columns': [column]}
-                else:
-                    tables[_id]['columns'].append(column)
+        catalog = self.__get_catalog(classified=show_type)
+        tables = {}
+        for schema_name, _id, name, column_name, data_type, structured in catalog['columns']:
+            if schema_name == self.__schema and not data_mining_tables:
+                continue
+            if table_name is not None and schema_name == 'public' and _id != table_name:
+                continue
             if show_type:
-                # classifying data with scructured or not.
-                for table in sorted(tables):
-                    columns = []
-                    for column in tables[table]['columns']:
-                        if column['data_type'] == 'text':
-                            columns.append(column['name'])
-                    for column in columns:
-                        query = f"select max(cardinality(string_to_array(\"{column}\", ' ')))" \
-                                f"from {tables[table]['schema']}.{table} " \
-                                f"where \"{column}\" is not null;"
-                        cursor.execute(query)
-                        word_size, = cursor.fetchone()
-                        for field in tables[table]['columns']:
-                            if field['name'] == column:
-                                i = tables[table]['columns'].index(field)
-                                if word_size is not None:
-                                    if word_size > self.__word_size_length_unstructured:
-                                        tables[table]['columns'][i]['structured'] = False
-                                break
-            if table_name is not None:
-                return tables[table_name]
+                column = {'name': column_name, 'data_type': data_type, 'structured': structured}
+            else:
+                column = column_name
+            if _id not in tables:
+                tables[_id] = {'schema': schema_name, 'name': name, 'columns': [column]}
             else:
-                return tables
+                tables[_id]['columns'].append(column)
+        if table_name is not None:
+            return tables[table_name]
+        else:
+            return tables
+
+    def invalidate_schema_cache(self):
+        """
+        Discard the schema catalog (tables, columns, structured classification and references), in memory and in the
+        table_column table. Called by the methods that change the schema; other processes reload the catalog on their
+        next Database instance.
+        """
+        with self.__connection.cursor() as cursor:
+            cursor.execute("""select to_regclass('public.table_column')""")
+            if cursor.fetchone()[0] is not None:
+                cursor.execute("""delete from table_column""")
+        self.__connection.commit()
+        self.catalogs.pop(self.__catalog_key(), None)
+        self.__catalog = None
+
+    def __catalog_key(self):
+        return self.__parameters['host'], self.__parameters.get('port'), self.__database, self.__schema
+
+    def __get_catalog(self, classified=False):
+        # o catálogo persistido é conferido uma vez por instância; depois as consultas são feitas apenas em memória
+        if self.__catalog is None:
+            with self.__connection.cursor() as cursor:
+                cursor.execute("""CREATE TABLE IF NOT EXISTS table_column(
+                    schema_name text,
+                    table_id text,
+                    table_name text,
+                    column_name text,
+                    data_type text,
+                    structured boolean,
+                    created timestamp default now(),
+                    primary key (schema_name, table_id, column_name)
+                );""")
+                cursor.execute("""select min(created) from table_column""")
+                version, = cursor.fetchone()
+                if version is None:
+                    self.__build_catalog(cursor)
+                    cursor.execute("""select min(created) from table_column""")
+                    version, = cursor.fetchone()
+            self.__connection.commit()
+            catalog = self.catalogs.get(self.__catalog_key())
+            if catalog is None or catalog['version'] != version:
+                catalog = self.__load_catalog(version)
+            self.__catalog = catalog
+        if classified and not self.__catalog['classified']:
+            # outra instância pode já ter classificado as colunas
+            self.__catalog = self.__load_catalog(self.__catalog['version'])
+            if not self.__catalog['classified']:
+                self.__classify_columns()
+                self.__catalog = self.__load_catalog(self.__catalog['version'])
+        return self.__catalog
+
+    def __build_catalog(self, cursor):
+        cursor.execute(f"""insert into table_column(schema_name, table_id, table_name, column_name, data_type)
+        select columns.table_schema, columns.table_name, table_name.name, "columns".column_name, "columns".data_type
+        from information_schema."columns"
+        join public.table_name on public.table_name.id = "columns".table_name
+        where columns.table_catalog = %s
+            and columns.table_schema = 'public'
+        union
+        select columns.table_schema, "columns".table_name, "columns".table_name, "columns".column_name,
+            "columns".data_type
+        from information_schema."columns"
+        where columns.table_catalog = %s
+            and columns.table_schema = '{self.__schema}'
+            and starts_with("columns".table_name, 'consolidated_')
+        on conflict do nothing""", (self.__database, self.__database))
+
+    def __load_catalog(self, version):
+        catalog = {'version': version, 'classified': True, 'columns': [], 'tables': {}, 'references': {}}
+        with self.__connection.cursor() as cursor:
+            cursor.execute("""select schema_name, table_id, table_name, column_name, data_type, structured
+            from table_column order by table_name, column_name""")
+            for schema_name, _id, name, column_name, data_type, structured in cursor.fetchall():
+                if structured is None:
+                    catalog['classified'] = False
+                catalog['columns'].append((schema_name, _id, name, column_name, data_type, structured))
+            cursor.execute("""select id, name, reference from table_name order by name""")
+            tables = catalog['tables']
+            for _id, name, reference in cursor.fetchall():
+                tables[_id] = {'name': name, 'reference': reference}
+            for _id in tables:
+                if tables[_id]['reference'] in tables:
+                    tables[_id]['reference_name'] = tables[tables[_id]['reference']]['name']
+                else:
+                    tables[_id]['reference_name'] = tables[_id]['reference']
+        self.__connection.commit()
+        self.catalogs[self.__catalog_key()] = catalog
+        return catalog
+
+    def __classify_columns(self):
+        # classificando dados como estruturados ou não, pelo maior número de palavras de cada coluna de texto
+        columns = {}
+        for schema_name, _id, name, column_name, data_type, structured in self.__catalog['columns']:
+            if structured is None:
+                columns.setdefault((schema_name, _id), []).append((column_name, data_type))
+        with self.__connection.cursor() as cursor, \
+                StatusBar('Classifying structured columns', len(columns)) as status_bar:
+            for (schema_name, table), table_columns in columns.items():
+                text_columns = [column for column, data_type in table_columns if data_type == 'text']
+                word_sizes = {}
+                if len(text_columns) > 0:
+                    # uma leitura da tabela para todas as colunas de texto
+                    query = ', '.join(f"max(cardinality(string_to_array(\"{column}\", ' ')))"
+                                      for column in text_columns)
+                    cursor.execute(f"select {query} from {schema_name}.{table};")
+                    word_sizes = dict(zip(text_columns, cursor.fetchone()))
+                for column, data_type in table_columns:
+                    word_size = word_sizes.get(column)
+                    structured = word_size is None or word_size <= self.__word_size_length_unstructured
+                    cursor.execute("""update table_column set structured = %s
+                    where schema_name = %s and table_id = %s and column_name = %s""",
+                                   (structured, schema_name, table, column))
+                status_bar.update()
+        self.__connection.commit()
 
     def get_table_count(self, table_name):
         with self.__connection.cursor() as cursor:
@@ -2202,34 +2753,30 @@ class Database:
         :param target: Target table. If None target will be the root table.
         :return: List of references tables.
         """
-        path = [{'name': table}]
-        with self.__connection.cursor() as cursor:
-            query = f"""select id, name, reference from table_name where id = %s"""
-            while True:
-                cursor.execute(query, (path[-1]['name'],))
-                record = cursor.fetchone()
-                if not record:
-                    break
-                _id, name, reference = record
+        catalog = self.__get_catalog()
+        if (table, target) not in catalog['references']:
+            tables = catalog['tables']
+            path = [{'name': table}]
+            while path[-1]['name'] in tables:
+                reference = tables[path[-1]['name']]['reference']
                 path[-1]['destination table'] = reference
                 path[-1]['destination key'] = 'internal_id'
                 path[-1]['origin key'] = f'{reference}_id'
                 path.append({'name': reference})
                 if reference == target:
                     break
-            if path[-1]['name'] != target:
-                cursor.execute(query, (target,))
-                record = cursor.fetchone()
-                if record:
-                    _id, name, reference = record
-                    path[-1]['destination table'] = target
-                    path[-1]['destination key'] = f'{reference}_id'
-                    path[-1]['origin key'] = 'internal_id'
-        return path
+            if path[-1]['name'] != target and target in tables:
+                reference = tables[target]['reference']
+                path[-1]['destination table'] = target
+                path[-1]['destination key'] = f'{reference}_id'
+                path[-1]['origin key'] = 'internal_id'
+            catalog['references'][(table, target)] = path
+        return deepcopy(catalog['references'][(table, target)])
 
     def get_table_related_data(self, table, reference_table, table_internal_id=None,
                                table_columns_filter: list | set = None):
-        with self.__connection.cursor() as cursor:
+        # sem filtro por registro a tabela inteira é lida, em blocos, por um cursor do servidor
+        with self.__connection.cursor() if table_internal_id else self.__server_cursor() as cursor:
             # recuperando referências até "reference_table"
             references = self.get_table_references(table, reference_table)
             table_columns_description = self.get_tables_columns(table_name=table, show_type=True)['columns']
@@ -2240,25 +2787,7 @@ class Database:
                 f"select {', '.join([f'{table}.{column} as {table}_{column}' for column in table_columns])}"
                 f", {', '.join([f'{reference_table}.{column} as {reference_table}_{column}' for column in reference_columns])}"
             )
-            for i, table_name in enumerate(references):
-                if i == 0:
-                    query = f"{query} from {table_name['name']}"
-                if table == reference_table:
-                    continue
-                # TODO: checar necessidade dessa instrução
-                # if 'destination table' in table_name and f"from {reference_table}" in query and table_name['destination table'] == reference_table:
-                #     continue
-                if 'destination table' in table_name:
-                    query = (
-                        f"{query} join {table_name['destination table']} on {table_name['name']}.{table_name['origin key']}"
-                        f" = {table_name['destination table']}.{table_name['destination key']}"
-                    )
-                # TODO: checar necessidade dessa instrução
-                # else:
-                #     query = (
-                #         f"{query} join {table_name['name']} on {table}.{table_name['name']}_id"
-                #         f" = {table_name['name']}.internal_id"
-                #     )
+            query = f"{query} {self.__join_query(table, reference_table, references)}"
             # filtrando por id do registro
             if table_internal_id:
                 if 'where' not in query:
@@ -2292,15 +2821,75 @@ class Database:
             for row in self.__unpack_results(cursor):
                 yield dict(zip(column_names, row))
 
+    def get_sample_accessions(self, table: str, internal_ids, schema: str = 'public') -> dict:
+        """
+        Sample accessions of rows of a table, resolved with one query by chunk of IDs.
+        :param table: Table name.
+        :param internal_ids: Internal IDs of the rows.
+        :param schema: Schema of the table. Tables of the data mining schema have their own accession column.
+        :return: Dictionary {internal_id: sample accession}. Rows without a sample are left out.
+        """
+        reference_table = 'experiment_package_sample'
+        if schema == self.__schema:
+            query = f"select internal_id, accession from {schema}.{table} where internal_id = any(%s)"
+        else:
+            references = self.get_table_references(table, reference_table)
+            query = (f"select {table}.internal_id, {reference_table}.accession "
+                     f"{self.__join_query(table, reference_table, references)} where {table}.internal_id = any(%s)")
+        accessions = {}
+        internal_ids = list(internal_ids)
+        with self.__connection.cursor() as cursor:
+            for start in range(0, len(internal_ids), self.__chunk_size):
+                cursor.execute(query, (internal_ids[start:start + self.__chunk_size],))
+                for internal_id, accession in cursor.fetchall():
+                    if internal_id not in accessions:
+                        accessions[internal_id] = accession
+                    elif accessions[internal_id] != accession:
+                        logging.warning(f"More then one accession detected for record {accessions[internal_id]}."
+                                        f" New: {accession}")
+        return accessions
+
+    def __join_query(self, table, reference_table, references):
+        # cláusula from com as junções de table até reference_table
+        key = self.__record_accession_key(table, reference_table, references)
+        if key is not None:
+            # uma consulta indexada na tabela de accessions no lugar das junções pela cadeia de referências
+            return (
+                f"from {table} join record_accession on record_accession.table_name = '{table}'"
+                f" and record_accession.internal_id = {table}.internal_id"
+                f" join {reference_table} on {reference_table}.internal_id = record_accession.{key}_id"
+            )
+        query = ''
+        for i, table_name in enumerate(references):
+            if i == 0:
+                query = f"from {table_name['name']}"
+            if table == reference_table:
+                continue
+            # TODO: checar necessidade dessa instrução
+            # if 'destination table' in table_name and f"from {reference_table}" in query and table_name['destination table'] == reference_table:
+            #     continue
+            if 'destination table' in table_name:
+                query = (
+                    f"{query} join {table_name['destination table']} on {table_name['name']}.{table_name['origin key']}"
+                    f" = {table_name['destination table']}.{table_name['destination key']}"
+                )
+            # TODO: checar necessidade dessa instrução
+            # else:
+            #     query = (
+            #         f"{query} join {table_name['name']} on {table}.{table_name['name']}_id"
+            #         f" = {table_name['name']}.internal_id"
+            #     )
+        return query
+
     # carrega registros de uma tabela
     def get_values_from_table(self, table: str, ids: list | set = None, schema: str = 'public'):
         query = f"select * from {schema}.{table}"
         if ids:
             query += f" where internal_id in ({', '.join([str(i) for i in ids])})"
         query += ";"
-        with self.__connection.cursor() as cursor:
+        with self.__server_cursor() as cursor:
             cursor.execute(query)
-            columns_names = [i[0] for i in cursor.description]
+            columns_names = self.__column_names(cursor)
             for row in self.__unpack_results(cursor):
                 yield dict(zip(columns_names, row))
 
@@ -2312,9 +2901,9 @@ class Database:
         elif isinstance(value, list) or isinstance(value, set):
             values = ','.join([f"'{i}'" for i in value])
             query = f"{query} where lower({column}) in ({values})"
-        with self.__connection.cursor() as cursor:
+        with self.__server_cursor() as cursor:
             cursor.execute(query)
-            columns_names = [i[0] for i in cursor.description]
+            columns_names = self.__column_names(cursor)
             for row in self.__unpack_results(cursor):
                 yield dict(zip(columns_names, row))
 
@@ -2444,76 +3033,161 @@ class Database:
 
     # insert database data
     def insert_from_xml(self, element: etree.ElementTree, entities: dict, references: dict, paths: dict,
-                        last_ids: dict = None, internal_id: int = 1, foreign_key: dict = None, start_node=None):
-        try:
-            path = element.getroottree().getelementpath(element)
-            if last_ids is None:
-                last_ids = {}
-            if foreign_key is None:
-                foreign_key = {}
-            if element.getroottree().getelementpath(element) == '.':
-                entity = format_name(element.tag)
-            else:
-                entity = format_name(path)
-            foreign_key[entity] = internal_id
+                        last_ids: dict = None, internal_id: int = 1, foreign_key: dict = None, start_node=None,
+                        batch_size: int = None) -> int:
+        """
+        Insert a XML document into the tables created from its structure. Rows are buffered by table and written with
+        COPY, in batches committed in one transaction each.
+        :param element: Root element.
+        :param entities: Entities generated by XML.generate_structure.
+        :param references: References generated by XML.generate_structure.
+        :param paths: Paths generated by XML.generate_structure.
+        :param last_ids: Last internal ID used by each table (element path). Updated in place.
+        :param internal_id: Internal ID of the root element.
+        :param foreign_key: Current internal ID of each table, used for the references.
+        :param start_node: Tag of the records.
+        :param batch_size: Rows by batch. Default is the chunk size of the database.
+        :return: Number of inserted rows.
+        """
+        if last_ids is None:
+            last_ids = {}
+        if foreign_key is None:
+            foreign_key = {}
+        element_path = element.getroottree().getelementpath(element)
+        with self.__bulk_insert(entities, references, batch_size) as bulk:
+            self.__insert_elements(bulk, [(element, () if element_path == '.' else (element_path,), internal_id)],
+                                   element.tag, entities, references, last_ids, foreign_key)
+        return bulk.rows
+
+    def insert_records(self, records: list, entities: dict, references: dict, first_ids: dict, root_tag: str,
+                       root_id: int = 1, batch_size: int = None) -> int:
+        """
+        Insert a block of records (children of the root element) with pre-assigned IDs. Blocks allocated by an
+        IdAllocator can be inserted in any order, by any process.
+        :param records: Children of the root element.
+        :param entities: Entities generated by XML.generate_structure.
+        :param references: References generated by XML.generate_structure.
+        :param first_ids: Last internal ID before the block, by table (element path), given by IdAllocator.allocate.
+        :param root_tag: Tag of the root element.
+        :param root_id: Internal ID of the root element.
+        :param batch_size: Rows by batch. Default is the chunk size of the database.
+        :return: Number of inserted rows.
+        """
+        with self.__bulk_insert(entities, references, batch_size) as bulk:
+            self.__insert_records(bulk, records, entities, references, first_ids, root_tag, root_id)
+        return bulk.rows
+
+    def __insert_file(self, xml, entities, references, root_tag, last_ids=None, batch_size=None, workers=None):
+        # registros lidos em blocos com iterparse, cada bloco com a sua faixa de IDs
+        allocator = IdAllocator(last_ids)
+        workers = workers or cpu_count()
+        if workers == 1:
+            with self.__bulk_insert(entities, references, batch_size) as bulk:
+                with open_file(xml) as xml_file:
+                    for records in XML.iterate_records(xml_file, self.__records_by_block):
+                        first_ids = allocator.allocate(XML.count_records(records))
+                        self.__insert_records(bulk, records, entities, references, first_ids, root_tag)
+            return bulk.rows
+        # cada bloco é serializado e inserido por um processo, com a sua própria conexão
+        worker_rows = Counter()
+        with ProcessPoolExecutor(max_workers=workers, initializer=initialize_worker,
+                                 initargs=(self.__arguments(), entities, references)) as executor:
+            futures = deque()
+            with open_file(xml) as xml_file:
+                for records in XML.iterate_records(xml_file, self.__records_by_block):
+                    first_ids = allocator.allocate(XML.count_records(records))
+                    data = b''.join(etree.tostring(record, with_tail=False) for record in records)
+                    futures.append(executor.submit(insert_xml_records, data, first_ids, root_tag, batch_size))
+                    # limitando os blocos em memória
+                    while len(futures) >= workers * 2:
+                        worker, rows = futures.popleft().result()
+                        worker_rows[worker] += rows
+            while len(futures) > 0:
+                worker, rows = futures.popleft().result()
+                worker_rows[worker] += rows
+        self.__log_worker_rows(worker_rows)
+        return sum(worker_rows.values())
+
+    @staticmethod
+    def __log_worker_rows(worker_rows):
+        for worker, rows in sorted(worker_rows.items()):
+            logging.info(f'Worker {worker}: {rows} rows inserted.')
+
+    def __bulk_insert(self, entities, references, batch_size=None):
+        # tabelas referenciadas são gravadas antes das tabelas que as referenciam
+        depths = {self.get_short_name(entity): self.__reference_depth(entity, references) for entity in entities}
+        return BulkInsert(self.__connection, batch_size=batch_size or self.__chunk_size,
+                          order=lambda table: depths.get(table, 0))
+
+    def __batch_writer(self, connection=None, batch_size=None):
+        # linhas gravadas com COPY a cada batch_size linhas, na transação de quem chama (tabelas temporárias e cursores
+        # abertos na mesma conexão não são afetados); flush ou o fim do bloco with grava o restante
+        return BulkInsert(connection or self.__connection, batch_size=batch_size or self.__chunk_size, commit=False)
+
+    def __insert_records(self, bulk, records, entities, references, first_ids, root_tag, root_id=1):
+        last_ids = dict(first_ids)
+        items = []
+        for record in records:
+            name = format_name(record.tag)
+            last_ids[name] = last_ids.get(name, 0) + 1
+            items.append((record, (record.tag,), last_ids[name]))
+        self.__insert_elements(bulk, items, root_tag, entities, references, last_ids,
+                               {format_name(root_tag): root_id})
+
+    def __insert_elements(self, bulk, items, root_tag, entities, references, last_ids, foreign_key):
+        names = {}
+
+        def get_name(tags):
+            if tags not in names:
+                names[tags] = format_name('/'.join(tags)) if len(tags) > 0 else format_name(root_tag)
+            return names[tags]
+
+        # colunas de cada tabela, na ordem do INSERT original
+        fields = {}
+        columns = {}
+        for entity in entities:
+            fields[entity] = [field for field in entities[entity] if field != 'internal_id']
+            columns[entity] = fields[entity] + ['internal_id']
+            if entity in references:
+                columns[entity].append(f'{self.get_short_name(references[entity])}_id')
+        # percorrendo em pré-ordem com uma pilha explícita
+        stack = list(reversed(items))
+        while len(stack) > 0:
+            node, tags, node_id = stack.pop()
+            entity = get_name(tags)
+            foreign_key[entity] = node_id
             if entity in entities:
-                fields = [field for field in entities[entity] if field != 'internal_id']
-                fields.append('internal_id')
-                if entity in references:
-                    fields.append(f'{self.get_short_name(references[entity])}_id')
-                query = f'INSERT INTO "{self.get_short_name(entity)}"('
-                query += ','.join(fields)
-                query += f') VALUES ({",".join(["%s"] * len(fields))});'
-                values = {}
-                for field in fields:
-                    values[field] = None
-                for field in entities[entity]:
-                    if entities[entity][field]['origin'] == 'attrib':
-                        for attrib in element.attrib:
-                            if field.lower() == attrib.lower():
-                                values[field] = element.get(attrib)
-                    elif entities[entity][field]['origin'] == 'text':
-                        if element.text is not None:
-                            values[field] = element.text
-                    elif entities[entity][field]['origin'] == 'tag':
-                        child_element = element.find(entities[entity][field]['tag'])
-                        values[field] = element.find(entities[entity][field]['tag']).text \
-                            if child_element is not None else None
-                    elif entities[entity][field]['origin'] == 'tag_empty':
-                        values[field] = True if element.find(entities[entity][field]['tag']) is not None else None
-                values['internal_id'] = internal_id
-                if entity in references:
-                    values[f'{self.get_short_name(references[entity])}_id'] = foreign_key[references[entity]]
-                with self.__connection.cursor() as cursor:
-                    with Lock():
-                        cursor.execute(
-                            query, [values[field] for field in fields]
-                        )
-                        self.__connection.commit()
-            with ProcessPoolExecutor(max_workers=cpu_count()) as executor:
-                for i, element_child in enumerate(element):
-                    child_name = format_name(element.getroottree().getelementpath(element_child))
-                    if child_name not in last_ids:
-                        last_ids[child_name] = 0
-                    last_ids[child_name] += 1
-                    if start_node == element.tag:
-                        executor.submit(self.insert_from_xml, **dict(
-                            element=element_child,
-                            entities=entities,
-                            references=references,
-                            paths=paths,
-                            last_ids=last_ids,
-                            internal_id=last_ids[child_name],
-                            foreign_key=foreign_key,
-                            start_node=start_node
-                        ))
-                    else:
-                        self.insert_from_xml(element=element_child, entities=entities, references=references,
-                                             paths=paths,
-                                             last_ids=last_ids, internal_id=last_ids[child_name],
-                                             foreign_key=foreign_key)
-        except Exception as err:
-            logging.error(f"{err}. 'Data insertion failed. Parent: {element.getroottree().getelementpath(element)}")
+                try:
+                    values = []
+                    attributes = None
+                    for field in fields[entity]:
+                        origin = entities[entity][field]['origin']
+                        if origin == 'attrib':
+                            if attributes is None:
+                                attributes = {attrib.lower(): value for attrib, value in node.attrib.items()}
+                            values.append(attributes.get(field.lower()))
+                        elif origin == 'text':
+                            values.append(node.text)
+                        elif origin == 'tag':
+                            child_element = node.find(entities[entity][field]['tag'])
+                            values.append(child_element.text if child_element is not None else None)
+                        elif origin == 'tag_empty':
+                            values.append(True if node.find(entities[entity][field]['tag']) is not None else None)
+                        else:
+                            values.append(None)
+                    values.append(node_id)
+                    if entity in references:
+                        values.append(foreign_key[references[entity]])
+                    bulk.add(self.get_short_name(entity), columns[entity], values)
+                except Exception as err:
+                    logging.error(f"{err}. 'Data insertion failed. Parent: {node.getroottree().getelementpath(node)}")
+            children = []
+            for element_child in node:
+                child_tags = tags + (element_child.tag,)
+                child_name = get_name(child_tags)
+                last_ids[child_name] = last_ids.get(child_name, 0) + 1
+                children.append((element_child, child_tags, last_ids[child_name]))
+            stack.extend(reversed(children))
 
     def search_by_equal_column(self, schema_name, table_name, cache=False) -> list:
         if cache:
@@ -2579,8 +3253,39 @@ class Database:
                                     results.append((column_a, column_b))
         return results
 
+    @contextmanager
+    def __server_cursor(self, connection=None):
+        """
+        Named cursor: the result stays on the server and is read in blocks of itersize rows. WITH HOLD keeps it open
+        after the commits done while reading, but the first commit materializes the rest of the result on the server
+        (in memory or temporary files), so scans that commit should be over tables that fit there.
+        """
+        connection = self.__connection if connection is None else connection
+        with connection.cursor(name=f'scan_{uuid4().hex}', withhold=True) as cursor:
+            cursor.itersize = self.__itersize
+            yield cursor
+
+    @staticmethod
+    def __column_names(cursor):
+        # cursores nomeados só recebem a descrição do resultado na primeira leitura
+        if cursor.description is None:
+            cursor.fetchmany(0)
+        return [column.name for column in cursor.description]
+
+    def __estimate_rows(self, query, parameters=None) -> int:
+        # tamanho das barras de progresso, que os cursores nomeados não informam: estimativa do planejador (a partir de
+        # pg_class.reltuples), sem executar a consulta uma segunda vez
+        with self.__connection.cursor() as cursor:
+            cursor.execute(f'explain (format json) {query.strip().rstrip(";")}', parameters)
+            return max(int(cursor.fetchone()[0][0]['Plan']['Plan Rows']), 1)
+
     @staticmethod
     def __unpack_results(cursor, size=10000):
+        if cursor.name is not None:
+            # cursor nomeado, lido em blocos de cursor.itersize linhas
+            for row in cursor:
+                yield row
+            return
         while True:
             rows = cursor.fetchmany(size)
             if len(rows) == 0:
@@ -2589,6 +3294,136 @@ class Database:
                 for row in rows:
                     yield row
 
+    @property
+    def __connection(self):
+        return self.__get_connection(0)
+
+    @property
+    def __connection_2(self):
+        return self.__get_connection(1)
+
+    def __get_connection(self, position):
+        if self.__connections[position] is None and self.__dbms == DBMS.POSTGRESQL:
+            pool, slots = self.__get_pool()
+            if not self.__pool_slot:
+                if not slots.acquire(timeout=self.__pool_timeout):
+                    raise PoolError(f'Connection pool exhausted: no Database instance was closed in '
+                                    f'{self.__pool_timeout} seconds. Close the instances (or use them in a with '
+                                    f'statement) when they are no longer needed, or increase pool_max_size.')
+                self.__pool_slot = True
+            try:
+                self.__connections[position] = pool.getconn()
+            except Exception:
+                self.__release_pool_slot(slots)
+                raise
+        return self.__connections[position]
+
+    def __get_pool(self):
+        # processos filhos (fork) não podem usar as conexões herdadas do processo pai
+        key = (getpid(), self.__pool_size, tuple(sorted(self.__parameters.items())))
+        with self.pools_lock:
+            if key not in self.pools:
+                # uma vaga por instância, com as duas conexões que ela pode usar
+                pool_min_size, pool_max_size = self.__pool_size
+                self.pools[key] = (ThreadedConnectionPool(pool_min_size, max(pool_max_size, 2), **self.__parameters),
+                                   BoundedSemaphore(max(pool_max_size // 2, 1)))
+            return self.pools[key]
+
+    def __release_pool_slot(self, slots):
+        if self.__pool_slot and all(connection is None for connection in self.__connections):
+            self.__pool_slot = False
+            slots.release()
+
+    def close(self):
+        """Return the connections to the pool. The instance can still be used, taking new connections."""
+        for position, connection in enumerate(self.__connections):
+            if connection is None:
+                continue
+            self.__connections[position] = None
+            pool, slots = self.__get_pool()
+            try:
+                # descartando transações, tabelas temporárias e configurações da sessão antes de reutilizar
+                connection.rollback()
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute('DISCARD ALL')
+                connection.autocommit = False
+                pool.putconn(connection)
+            except psycopg2.Error:
+                pool.putconn(connection, close=True)
+            finally:
+                self.__release_pool_slot(slots)
+
+    @classmethod
+    def close_pools(cls):
+        """Close the idle connections of the pools of this process, e.g. before dropping a database."""
+        with cls.pools_lock:
+            for key in [key for key in cls.pools if key[0] == getpid()]:
+                pool, slots = cls.pools.pop(key)
+                pool.closeall()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def __del__(self):
-        if self.__connection:
-            self.__connection.close()
+        try:
+            self.close()
+        except Exception:
+            # encerramento do interpretador; as conexões são fechadas com o processo
+            pass
+
+
+worker_database = None
+worker_structure = None
+worker_mining = None
+
+
+# Abre uma conexão por processo de inserção, reutilizada por todas as tarefas do processo
+def initialize_worker(arguments, entities, references):
+    global worker_database, worker_structure
+    worker_database = Database(**arguments)
+    worker_structure = (entities, references)
+
+
+# Insere um shard XML em um processo de inserção
+def insert_xml_shard(shard, last_ids, start_node=None, batch_size=None):
+    entities, references = worker_structure
+    return getpid(), worker_database.insert_from_xml_shard(shard, entities, references, last_ids, start_node,
+                                                           batch_size)
+
+
+# Insere um bloco de registros serializado em um processo de inserção
+def insert_xml_records(data, first_ids, root_tag, batch_size=None):
+    entities, references = worker_structure
+    records = etree.fromstring(b'<records>' + data + b'</records>',
+                               etree.XMLParser(remove_blank_text=True, remove_comments=True))
+    return getpid(), worker_database.insert_records(list(records), entities, references, first_ids, root_tag,
+                                                    batch_size=batch_size)
+
+
+# Carrega Mining (corpus e MeSH) uma vez por processo de anotação
+def initialize_annotation_worker():
+    global worker_mining
+    worker_mining = Mining()
+
+
+# Anota um bloco de registros (internal_id, texto), retornando (internal_id, anotação em JSON, erro) dos registros com
+# entidades ou com erro
+def annotate_records(records, mining=None):
+    mining = mining or worker_mining
+    if mining is None:
+        raise RuntimeError('Mining is not loaded: call annotate_records with a Mining instance or in a process started '
+                           'with initialize_annotation_worker.')
+    results = []
+    for internal_id, text in records:
+        try:
+            trees = mining.get_pos_tag(text, entity=True)
+        except Exception as err:
+            results.append((internal_id, None, str(err)))
+            continue
+        if any(isinstance(node, Tree) for tree in trees for node in tree):
+            results.append((internal_id, json.dumps(Mining.get_annotation(trees)), None))
+    return results
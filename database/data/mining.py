@@ -1,3 +1,4 @@
+import ast
 from collections import namedtuple
 from concurrent.futures import as_completed, ProcessPoolExecutor
 from multiprocessing import cpu_count
@@ -32,6 +33,8 @@ import logging
 class Mining:
     # atributo para garantir que os corpus só serão checados na primeira instância.
     downloaded_corpus = False
+    # versão do formato das anotações gravadas em table_annotation.entities
+    annotation_version = 1
 
     def __init__(self):
         if Mining.downloaded_corpus is False:
@@ -211,6 +214,66 @@ class Mining:
                 results.append(subtree)
         return tuple(results)
 
+    @classmethod
+    def get_annotation(cls, trees) -> dict:
+        """
+        Compact form of the annotated sentences returned by get_pos_tag(entity=True), stored as JSON.
+        :param trees: List of sentence trees.
+        :return: {'version': annotation_version, 'spans': [[sentence, label, start, end, tokens], ...]}, where start and
+        end are the positions of the first and after the last token of the entity in the sentence. Spans are in the order
+        of get_entities_from_tree, nested entities included.
+        """
+        spans = []
+
+        def visit(sentence, node, start):
+            index = None
+            if node.label() != 'S':
+                index = len(spans)
+                spans.append(None)
+            end = start
+            for child in node:
+                end = visit(sentence, child, end) if isinstance(child, Tree) else end + 1
+            if index is not None:
+                spans[index] = [sentence, node.label(), start, end, [leaf[0] for leaf in node.leaves()]]
+            return end
+
+        for i, tree in enumerate(trees):
+            visit(i, tree, 0)
+        return {'version': cls.annotation_version, 'spans': spans}
+
+    @classmethod
+    def get_entities_from_annotation(cls, annotation: dict):
+        """
+        Entities of an annotation written by get_annotation.
+        :param annotation: Annotation.
+        :return: Tuple of Span(sentence, label, start, end, tokens).
+        """
+        if annotation.get('version') != cls.annotation_version:
+            raise ValueError(f"Unknown annotation version: {annotation.get('version')}.")
+        Span = namedtuple('Span', 'sentence label start end tokens')
+        return tuple(Span(*span) for span in annotation['spans'])
+
+    @staticmethod
+    def parse_trees(text: str) -> list:
+        """
+        Read the str() of a list of trees, the annotation format of previous versions, without eval.
+        :param text: Text such as "[Tree('S', [('word', 'NN'), ...])]".
+        :return: List of trees.
+        """
+        def convert(node):
+            if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'Tree'
+                    and len(node.args) == 2 and len(node.keywords) == 0):
+                return Tree(convert(node.args[0]), convert(node.args[1]))
+            if isinstance(node, ast.List):
+                return [convert(i) for i in node.elts]
+            if isinstance(node, ast.Tuple):
+                return tuple(convert(i) for i in node.elts)
+            if isinstance(node, ast.Constant):
+                return node.value
+            raise ValueError(f'Unexpected expression in annotation tree: {ast.dump(node)}')
+
+        return convert(ast.parse(text, mode='eval').body)
+
     def get_mesh_term(self, term: str):
         self.mesh
 
@@ -1,126 +1,499 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from datetime import date
+from hashlib import sha256
+from io import BytesIO
+from itertools import islice
+from os import makedirs
+from os import path
+from os import remove
+from os import replace
 from requests.utils import requote_uri
+from threading import Lock
+from urllib.parse import urlencode
+from urllib.request import Request
 from urllib.request import urlopen
+from lxml.etree import iterparse
 from lxml.etree import parse
+from lxml.etree import xmlfile
 from lxml.etree import XMLParser
+import csv
+import json
 import progressbar
+import re
+from .util import open_file
+from time import monotonic
 from time import sleep
-from time import time
+
+
+class TokenBucket:
+    """Token bucket shared by threads. Each request takes a token and tokens are refilled at a fixed rate."""
+    def __init__(self, rate, burst=1):
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = burst
+        self.__updated = monotonic()
+        self.__lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self.__lock:
+                now = monotonic()
+                self.__tokens = min(self.__burst, self.__tokens + (now - self.__updated) * self.__rate)
+                self.__updated = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.__rate
+            sleep(wait)
 
 
 class SRA:
-    def __init__(self):
+    def __init__(self, url='https://eutils.ncbi.nlm.nih.gov/entrez/eutils', api_key=None, workers=None,
+                 use_history=False, pagination=400, cache=None):
         # Entrez Utilities request URL.
-        self.__url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils'
+        self.__url = url
+        # ResponseCache of E-utilities responses.
+        self.__cache = cache
         self.__database = 'sra'
-        self.__max_request_by_second = 3
-        self.__last_request_time = []
+        # NCBI allows 3 requests by second, or 10 with an API key.
+        self.__api_key = api_key
+        self.__max_request_by_second = 3 if api_key is None else 10
+        self.__rate_limiter = TokenBucket(self.__max_request_by_second)
+        # pages retrieved at the same time.
+        self.__workers = self.__max_request_by_second if workers is None else workers
+        self.__publications_lock = Lock()
         # items by package.
-        self.__pagination = 400
+        self.__pagination = pagination
+        # keep the search result on the Entrez history server and fetch pages by WebEnv/query_key.
+        self.__use_history = use_history
+        # root tag of EFetch SRA documents.
+        self.__root_tag = 'EXPERIMENT_PACKAGE_SET'
+        # checkpoint files.
+        self.__manifest_name = 'manifest.json'
+        self.__index_tags = ('EXPERIMENT_PACKAGE', 'EXPERIMENT', 'STUDY', 'SAMPLE', 'RUN')
+        # UIDs by ESummary request.
+        self.__summary_pagination = 10000
+        self.__experiment_accession = re.compile(r'<Experiment\s+acc="([^"]+)"')
+
+    def esearch(self, term, only_public=True):
+        """Run the first ESearch page of an Entrez query.
 
-    def is_max_request_alcanced(self):
-        self.__last_request_time.insert(0, time())
-        if len(self.__last_request_time) <= self.__max_request_by_second:
-            return False
+        :param term: Entrez query.
+        :param only_public: Restrict the query to public records.
+        :return: Dictionary with the query URL, the records count, the history server keys and the first page."""
+        query = self.__search_query(term, only_public)
+        if self.__use_history:
+            # IDs are not needed, pages are fetched from the history server.
+            # the WebEnv expires on the server, so the search itself is only read from the cache when offline.
+            records = self.query(f'{query}&RetMax=0&usehistory=y', refresh=True)
         else:
-            oldest = self.__last_request_time.pop()
-            if self.__last_request_time[0] - oldest < 3:
-                return True
-        return False
+            records = self.query(f'{query}&RetMax={self.__pagination}&RetStart=0')
+        query += f'&RetMax={self.__pagination}'
+        if records is None:
+            raise ConnectionError(f'Failed to query {query}.')
+        return {
+            'query': query,
+            'count': int(records.findtext('./Count')),
+            'webenv': records.findtext('./WebEnv'),
+            'query_key': records.findtext('./QueryKey'),
+            'records': records,
+        }
+
+    def summaries(self, term, only_public=True, mindate=None, maxdate=None, datetype='mdat'):
+        """Map the UIDs of an Entrez query to their experiment accessions.
+
+        The query is kept on the history server and its ESummary documents are read in pages of up to 10000 UIDs, so
+        the full records are not downloaded.
+
+        :param term: Entrez query.
+        :param only_public: Restrict the query to public records.
+        :param mindate: Only records with datetype since this date (YYYY/MM/DD).
+        :param maxdate: Only records with datetype until this date. Default is today.
+        :param datetype: Date used by mindate and maxdate, mdat (modification) or pdat (publication).
+        :return: Dictionary of experiment accession by UID, in the order of the search."""
+        query = self.__search_query(term, only_public)
+        if mindate is not None:
+            query += f'&datetype={datetype}&mindate={mindate}&maxdate={maxdate or date.today().strftime("%Y/%m/%d")}'
+        records = self.query(f'{query}&RetMax=0&usehistory=y', refresh=True)
+        if records is None:
+            raise ConnectionError(f'Failed to query {query}.')
+        count = int(records.findtext('./Count'))
+        summary_query = f'{self.__url}/esummary.fcgi?db={self.__database}&WebEnv={records.findtext("./WebEnv")}' \
+                        f'&query_key={records.findtext("./QueryKey")}'
+        accessions = {}
+        for offset in range(0, count, self.__summary_pagination):
+            summary = self.query(f'{summary_query}&retstart={offset}&retmax={self.__summary_pagination}',
+                                 refresh=True)
+            if summary is None:
+                raise ConnectionError(f'Failed to retrieve summaries of page {offset}.')
+            for document in summary.getroot().iterfind('DocSum'):
+                # ExpXml is an escaped XML fragment.
+                experiment = self.__experiment_accession.search(document.findtext("Item[@Name='ExpXml']") or '')
+                if experiment is not None:
+                    accessions[document.findtext('Id')] = experiment.group(1)
+        return accessions
+
+    def delta(self, term, known_accessions, only_public=True, mindate=None, maxdate=None, datetype='mdat'):
+        """Find the records of an Entrez query that are not in a database yet or were updated.
+
+        :param term: Entrez query.
+        :param known_accessions: Experiment accessions already in the database.
+        :param only_public: Restrict the query to public records.
+        :param mindate: Records with datetype since this date are retrieved again, even if already known.
+        :param maxdate: Upper limit of datetype. Default is today.
+        :param datetype: Date used by mindate and maxdate, mdat (modification) or pdat (publication).
+        :return: Search result for pages with the new and updated UIDs, and the accessions of the updated records."""
+        known_accessions = set(known_accessions)
+        accessions = self.summaries(term, only_public=only_public)
+        ids = [uid for uid, accession in accessions.items() if accession not in known_accessions]
+        updated_accessions = []
+        if mindate is not None:
+            for uid, accession in self.summaries(term, only_public=only_public, mindate=mindate, maxdate=maxdate,
+                                                 datetype=datetype).items():
+                if accession in known_accessions:
+                    ids.append(uid)
+                    updated_accessions.append(accession)
+        print(f'{len(ids) - len(updated_accessions)} new and {len(updated_accessions)} updated records.', flush=True)
+        query = self.__search_query(term, only_public)
+        return {
+            # identifies the delta in the checkpoint manifest.
+            'query': f'{query}&delta={sha256(",".join(ids).encode()).hexdigest()}',
+            'count': len(ids),
+            'webenv': None,
+            'query_key': None,
+            'records': None,
+            'ids': ids,
+        }, updated_accessions
 
     def fetch(self, database_name, ids):
+        query = f'{self.__url}/efetch.fcgi' \
+                f'?db={database_name}' \
+                f'&retmode=xml'
+        # IDs are sent in the request body to keep the URL short.
+        return self.query(query, parameters={'id': ids if isinstance(ids, str) else ",".join(ids)})
+
+    def fetch_history(self, database_name, webenv, query_key, retstart, retmax, cache_key=None):
         query = f'{self.__url}/efetch.fcgi' \
                 f'?db={database_name}' \
                 f'&retmode=xml' \
-                f'&id={ids if isinstance(ids, str) else ",".join(ids)}'
-        return self.query(query)
+                f'&WebEnv={webenv}' \
+                f'&query_key={query_key}' \
+                f'&retstart={retstart}' \
+                f'&retmax={retmax}'
+        return self.query(query, cache_key=cache_key)
+
+    def pages(self, term, only_public=True, skip_offsets=None, search_result=None):
+        """Retrieve the SRA records of an Entrez query one EFetch page at a time.
+
+        Pages are retrieved by a pool of threads, but only a few pages are kept in memory and they are yielded in
+        offset order, so the caller can write or ingest each page as soon as it arrives.
+
+        :param term: Entrez query.
+        :param only_public: Restrict the query to public records.
+        :param skip_offsets: Page offsets (RetStart values) already retrieved.
+        :param search_result: Result of a previous call to esearch or delta for the same query.
+        :return: Generator of (offset, EXPERIMENT_PACKAGE_SET document) with their PubMed articles attached."""
+        publications = {}
+        skip_offsets = set() if skip_offsets is None else set(skip_offsets)
 
-    def query(self, query):
+        if search_result is None:
+            search_result = self.esearch(term, only_public=only_public)
+        records_count = search_result['count']
+        print(f'{records_count} records founded.', flush=True)
+
+        offsets = range(0, records_count, self.__pagination)
+        status_bar = progressbar.ProgressBar(
+            maxval=len(offsets) + 1,  # for multiple
+            widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()],
+        )
+        if len(skip_offsets) > 0:
+            print(f'{len(skip_offsets & set(offsets))} pages already retrieved.', flush=True)
+        print(f'Retrieving data...', flush=True)
+        status_bar.start()
+
+        step = len(skip_offsets & set(offsets))
+        status_bar.update(step)
+        offsets = iter([offset for offset in offsets if offset not in skip_offsets])
+        with ThreadPoolExecutor(max_workers=self.__workers) as executor:
+            futures = deque()
+            for offset in islice(offsets, self.__workers * 2):
+                futures.append((offset, executor.submit(self.__page, search_result, offset, publications)))
+            while len(futures) > 0:
+                offset, future = futures.popleft()
+                experiment = future.result()
+                next_offset = next(offsets, None)
+                if next_offset is not None:
+                    futures.append((next_offset, executor.submit(self.__page, search_result, next_offset,
+                                                                 publications)))
+                yield offset, experiment
+                step += 1
+                status_bar.update(step)
+        status_bar.finish()
+
+    def query(self, query, parameters=None, cache_key=None, refresh=False):
+        """Send a request to E-utilities and parse the XML response.
+
+        :param query: Request URL.
+        :param parameters: Parameters sent in the request body (POST).
+        :param cache_key: Cache key of the request. Default is the normalized request.
+        :param refresh: Ignore the cached response, unless the cache is offline.
+        :return: XML document or None if the request failed."""
+        if self.__cache is not None:
+            if cache_key is None:
+                cache_key = self.__cache.key(query, parameters)
+            if not refresh or self.__cache.offline:
+                data = self.__cache.get(cache_key)
+                if data is not None:
+                    return parse(BytesIO(data), XMLParser(remove_blank_text=True, remove_comments=True))
+            if self.__cache.offline:
+                raise ConnectionError(f'{query} is not cached and the downloader is offline.')
+        if self.__api_key is not None:
+            query += f'&api_key={self.__api_key}'
         tentativa = 10
         while tentativa > 0:
             try:
-                if self.is_max_request_alcanced():
-                    sleep(2)
-                document = urlopen(query)
+                self.__rate_limiter.acquire()
+                if parameters is None:
+                    document = urlopen(query, timeout=300)
+                else:
+                    document = urlopen(Request(query, data=urlencode(parameters).encode()), timeout=300)
                 while document.status != 200:
                     sleep_time = 1
                     print(f'Retrieving data package failed. {document.status} error. Retrying in {sleep_time} seconds...', flush=True)
                     sleep(sleep_time)
-                data = parse(document, XMLParser(remove_blank_text=True, remove_comments=True))
+                content = document.read()
                 document.close()
+                data = parse(BytesIO(content), XMLParser(remove_blank_text=True, remove_comments=True))
+                if self.__cache is not None:
+                    self.__cache.set(cache_key, content)
                 return data
             except Exception as err:
                 tentativa -= 1
                 print(err)
         return None
 
-    def search(self, term, only_public=True, database_file='database.xml'):
-        experiments = None
-        publications = {}
+    def search(self, term, only_public=True, database_file='database.xml', checkpoint_directory=None,
+               compression=None, known_accessions=None, mindate=None, maxdate=None, datetype='mdat'):
+        """Retrieve the SRA records of an Entrez query into a XML file.
 
-        query = f'{self.__url}/esearch.fcgi?db={self.__database}&term={term}'
-        if only_public:
-            query += f'+AND+"public"[Access]'
-        query = requote_uri(query)
-        query += f'&RetMax={self.__pagination}'
+        :param term: Entrez query.
+        :param only_public: Restrict the query to public records.
+        :param database_file: Output XML file. Files ending with .gz or .zst are compressed. When None, the pages in
+        checkpoint_directory are kept as shards (one XML file by page) and an index of accessions by shard is written
+        to index.csv instead of joining them.
+        :param checkpoint_directory: Directory to keep each page and the checkpoint manifest. A rerun with the same
+        directory resumes from the pages already retrieved.
+        :param compression: Compression of the shards (gz or zst) when database_file is None.
+        :param known_accessions: Experiment accessions already in the database. When given, only the records not in
+        it (and the ones updated since mindate) are retrieved.
+        :param mindate: Retrieve again the known records with datetype since this date (YYYY/MM/DD).
+        :param maxdate: Upper limit of datetype. Default is today.
+        :param datetype: Date used by mindate and maxdate, mdat (modification) or pdat (publication).
+        :return: Accessions of the known records retrieved again when known_accessions is given, None otherwise."""
+        if database_file is None and checkpoint_directory is None:
+            raise ValueError('A checkpoint directory is required to keep the pages as shards.')
+        search_result = None
+        updated_accessions = None
+        if known_accessions is not None:
+            search_result, updated_accessions = self.delta(term, known_accessions, only_public=only_public,
+                                                           mindate=mindate, maxdate=maxdate, datetype=datetype)
+        if checkpoint_directory is None:
+            # each page is written as soon as it arrives, so memory use does not grow with the result size.
+            with open_file(database_file, 'wb') as file, xmlfile(file, encoding='utf-8') as output:
+                output.write_declaration()
+                with output.element(self.__root_tag):
+                    for _, experiment in self.pages(term, only_public=only_public, search_result=search_result):
+                        for item in experiment.getroot():
+                            output.write(item)
+                        output.flush()
+            return updated_accessions
 
-        continuar = True
-        status_bar = progressbar.ProgressBar()
-        step = 0
-        records_count = 0
+        makedirs(checkpoint_directory, exist_ok=True)
+        if search_result is None:
+            search_result = self.esearch(term, only_public=only_public)
+        manifest = self.__load_manifest(checkpoint_directory, search_result)
+        # pages are compressed like the output file.
+        if database_file is None:
+            compression = f'.{compression}' if compression else ''
+        else:
+            compression = ''.join(f'.{extension}' for extension in ('gz', 'zst')
+                                  if database_file.endswith(f'.{extension}'))
+        for offset, experiment in self.pages(term, only_public=only_public, skip_offsets=manifest['pages'].keys(),
+                                             search_result=search_result):
+            page_file = f'page_{offset:09d}.xml{compression}'
+            with open_file(path.join(checkpoint_directory, f'tmp_{page_file}'), 'wb') as file:
+                experiment.write(file, encoding='utf-8', xml_declaration=True)
+            replace(path.join(checkpoint_directory, f'tmp_{page_file}'), path.join(checkpoint_directory, page_file))
+            manifest['pages'][offset] = {
+                'file': page_file,
+                'sha256': self.__file_digest(path.join(checkpoint_directory, page_file)),
+            }
+            self.__save_manifest(checkpoint_directory, manifest)
 
-        while True:
-            records = self.query(f'{query}&RetStart={step * self.__pagination}')
-            ids = [item.text for item in records.findall('./IdList/Id')]
-
-            if step == 0:
-                # getting status information
-                records_count = int(records.findtext('./Count'))
-                print(f'{records_count} records founded.', flush=True)
-                status_bar = progressbar.ProgressBar(
-                    maxval=int(records_count / self.__pagination) + 1,  # for multiple
-                    # maxval=int(records_count),
-                    widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()],
-                )
-                print(f'Retrieving data...', flush=True)
-                status_bar.start()
-            if (step * self.__pagination) >= records_count:
-                break
-            # Retrieving data
+        if database_file is None:
+            self.__write_index(checkpoint_directory, manifest)
+            return updated_accessions
+
+        # joining pages in offset order, one page in memory at a time.
+        with open_file(database_file, 'wb') as file, xmlfile(file, encoding='utf-8') as output:
+            output.write_declaration()
+            with output.element(self.__root_tag):
+                for offset in sorted(manifest['pages']):
+                    with open_file(path.join(checkpoint_directory, manifest['pages'][offset]['file'])) as page:
+                        experiment = parse(page, XMLParser(remove_blank_text=True, remove_comments=True))
+                    for item in experiment.getroot():
+                        output.write(item)
+                    output.flush()
+        return updated_accessions
+
+    @staticmethod
+    def __file_digest(file_name):
+        digest = sha256()
+        with open(file_name, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def __load_manifest(self, checkpoint_directory, search_result):
+        query_hash = sha256(f'{search_result["query"]}&pagination={self.__pagination}'.encode()).hexdigest()
+        manifest = {
+            'query': search_result['query'],
+            'query_hash': query_hash,
+            'count': search_result['count'],
+            'pagination': self.__pagination,
+            'webenv': search_result['webenv'],
+            'query_key': search_result['query_key'],
+            'pages': {},
+        }
+        manifest_file = path.join(checkpoint_directory, self.__manifest_name)
+        if path.exists(manifest_file):
+            with open(manifest_file, 'r') as file:
+                previous = json.load(file)
+            if previous['query_hash'] != query_hash or previous['count'] != search_result['count']:
+                if previous['query_hash'] != query_hash:
+                    print(f'Checkpoint manifest belongs to another query. Starting over.', flush=True)
+                else:
+                    print(f'Records count changed from {previous["count"]} to {search_result["count"]}. '
+                          f'Starting over.', flush=True)
+                # pages of the previous query must not be taken as shards of this one.
+                for page in previous['pages'].values():
+                    if path.exists(path.join(checkpoint_directory, page['file'])):
+                        remove(path.join(checkpoint_directory, page['file']))
+            else:
+                # keeping only pages whose file is intact.
+                for offset, page in previous['pages'].items():
+                    page_file = path.join(checkpoint_directory, page['file'])
+                    if path.exists(page_file) and self.__file_digest(page_file) == page['sha256']:
+                        manifest['pages'][int(offset)] = page
+        self.__save_manifest(checkpoint_directory, manifest)
+        return manifest
+
+    def __page(self, search_result, offset, publications):
+        if search_result['webenv'] is not None:
+            # getting experiment data from the history server
+            # the page is cached by the search query, since the WebEnv changes on every search.
+            cache_key = None if self.__cache is None else self.__cache.key(
+                search_result['query'], {'efetch': self.__database, 'retstart': offset})
+            experiment = self.fetch_history(self.__database, search_result['webenv'], search_result['query_key'],
+                                            offset, self.__pagination, cache_key=cache_key)
+            if experiment is None:
+                raise ConnectionError(f'Failed to retrieve records of page {offset}.')
+            packages = self.__index_pubmed_links(experiment)
+            # only articles cited by XREF_LINK are attached, so the links are read from the page itself.
+            linked_ids = sorted(packages)
+        else:
+            if search_result.get('ids') is not None:
+                ids = search_result['ids'][offset:offset + self.__pagination]
+            else:
+                if offset == 0:
+                    records = search_result['records']
+                else:
+                    records = self.query(f'{search_result["query"]}&RetStart={offset}')
+                if records is None:
+                    raise ConnectionError(f'Failed to query {search_result["query"]}&RetStart={offset}.')
+                ids = [item.text for item in records.findall('./IdList/Id')]
 
             # getting experiment data
             experiment = self.fetch(self.__database, ','.join(ids))
+            if experiment is None:
+                raise ConnectionError(f'Failed to retrieve records of page {offset}.')
+            packages = self.__index_pubmed_links(experiment)
 
             # Querying related literacture from pubmed
-            links_query = f'{self.__url}/elink.fcgi?dbfrom={self.__database}&db=pubmed&id={",".join(ids)}'
-            publication = self.query(links_query)
-            linked_ids = {}
+            links_query = f'{self.__url}/elink.fcgi?dbfrom={self.__database}&db=pubmed'
+            publication = self.query(links_query, parameters={'id': ",".join(ids)})
+            if publication is None:
+                raise ConnectionError(f'Failed to retrieve PubMed links of page {offset}.')
+            linked_ids = []
             for item in publication.findall('.LinkSet/LinkSetDb'):
                 if item.find('DbTo') is not None and item.find('DbTo').text == 'pubmed':
-                    if item.find('DbTo').text not in linked_ids:
-                        linked_ids[item.find('DbTo').text] = []
                     for link in item.findall('Link/Id'):
-                        linked_ids[item.find('DbTo').text].append(link.text)
-            for ncbi_database in linked_ids:
-                if len(linked_ids[ncbi_database]) > 0:
-                    chaves = ",".join(linked_ids[ncbi_database])
-                    if chaves in publications:
-                        publication = publications[chaves]
-                    else:
-                        publication = self.fetch(ncbi_database, chaves)
-                        publications[chaves] = publication
-                    for item in publication.findall('./'):
-                        pmid = item.find('MedlineCitation/PMID')
-                        if pmid is not None and pmid.text is not None:
-                            for child in experiment.xpath(f'//XREF_LINK[DB="pubmed" and ID="{pmid.text}"]'):
-                                parent = child.xpath('ancestor::EXPERIMENT_PACKAGE')[0]
-                                if item not in parent:
-                                    parent.append(item)
-            if experiments is None:
-                experiments = experiment
-            else:
-                for item in experiment.findall('./'):
-                    experiments.getroot().append(item)
-            step += 1
-            status_bar.update(step)
-        status_bar.finish()
-        experiments.write(database_file)
+                        linked_ids.append(link.text)
+
+        # articles are cached by PMID, so only the ones not seen in previous pages are fetched.
+        with self.__publications_lock:
+            missing_ids = sorted({pmid for pmid in linked_ids if pmid not in publications})
+        if len(missing_ids) > 0:
+            publication = self.fetch('pubmed', missing_ids)
+            if publication is None:
+                raise ConnectionError(f'Failed to retrieve PubMed articles of page {offset}.')
+            with self.__publications_lock:
+                for item in publication.findall('./'):
+                    pmid = item.findtext('MedlineCitation/PMID')
+                    if pmid is not None:
+                        publications.setdefault(pmid, item)
+        # cached articles are shared by threads and by pages, so each package receives its own copy.
+        with self.__publications_lock:
+            for pmid in set(linked_ids):
+                if pmid in publications and pmid in packages:
+                    for package in packages[pmid]:
+                        package.append(deepcopy(publications[pmid]))
+        return experiment
+
+    @staticmethod
+    def __index_pubmed_links(experiment):
+        """Map each PMID cited by a XREF_LINK to the EXPERIMENT_PACKAGE elements citing it."""
+        packages = {}
+        for package in experiment.getroot().iterfind('EXPERIMENT_PACKAGE'):
+            for link in package.iter('XREF_LINK'):
+                if link.findtext('DB') == 'pubmed':
+                    pmid = link.findtext('ID')
+                    if pmid is not None:
+                        if pmid not in packages:
+                            packages[pmid] = [package]
+                        elif packages[pmid][-1] is not package:
+                            packages[pmid].append(package)
+        return packages
+
+    def __search_query(self, term, only_public=True):
+        query = f'{self.__url}/esearch.fcgi?db={self.__database}&term={term}'
+        if only_public:
+            query += f'+AND+"public"[Access]'
+        return requote_uri(query)
+
+    def __write_index(self, checkpoint_directory, manifest):
+        # accession -> shard, reading only the accession attributes of each page.
+        index_file = path.join(checkpoint_directory, 'index.csv')
+        with open(f'{index_file}.tmp', 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['accession', 'type', 'shard'])
+            for offset in sorted(manifest['pages']):
+                page_file = manifest['pages'][offset]['file']
+                accessions = {}
+                with open_file(path.join(checkpoint_directory, page_file)) as page:
+                    for _, element in iterparse(page, tag=self.__index_tags):
+                        if element.get('accession') is not None:
+                            accessions[element.get('accession')] = element.tag.lower()
+                        if element.tag == 'EXPERIMENT_PACKAGE':
+                            element.clear()
+                writer.writerows([accession, accession_type, page_file]
+                                 for accession, accession_type in accessions.items())
+        replace(f'{index_file}.tmp', index_file)
+
+    def __save_manifest(self, checkpoint_directory, manifest):
+        manifest_file = path.join(checkpoint_directory, self.__manifest_name)
+        with open(f'{manifest_file}.tmp', 'w') as file:
+            json.dump(manifest, file, indent=2)
+        replace(f'{manifest_file}.tmp', manifest_file)
@@ -1,4 +1,5 @@
 import csv
+import gzip
 from datetime import datetime
 
 from progressbar import ProgressBar, Bar, Percentage
@@ -63,6 +64,27 @@ def format_name(name):
     return name
 
 
+def open_file(file_name: str, mode: str = 'rb'):
+    """Open a file compressed according to its extension: gzip (.gz), zstandard (.zst) or none.
+
+    :param file_name: File path.
+    :param mode: 'rb' or 'wb'.
+    :return: Binary file object."""
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, mode, compresslevel=6)
+    elif file_name.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstandard package is required to read or write .zst files. '
+                              'Install it with "pip install zstandard".')
+        if 'r' in mode:
+            return zstandard.ZstdDecompressor().stream_reader(open(file_name, 'rb'), closefd=True)
+        else:
+            return zstandard.ZstdCompressor(level=6).stream_writer(open(file_name, 'wb'), closefd=True)
+    return open(file_name, mode)
+
+
 def get_combinations(data_keys: list | tuple):
     # Alternativa à itertools.combination 2 a 2.
     data_index = np.arange(len(data_keys))
@@ -1,91 +1,264 @@
-from multiprocessing import cpu_count
+from collections import Counter
+from glob import glob
 from lxml import etree
+from os import path
 from .util import format_name
-from threading import Lock
-from concurrent.futures import ThreadPoolExecutor
 
 
-lock = Lock()
+class StructureInference:
+    """Infer the tables (structure), references and paths of an XML document in a single pre-order pass.
 
+    Each child of the root element is processed as soon as it is complete and can then be discarded, so a document
+    can be streamed with iterparse keeping only one record in memory. Element paths are built from a stack of tags
+    instead of being computed for every node."""
+    def __init__(self, structure: dict, references: dict, paths: dict, start_node=None, counts: Counter = None):
+        """
+        :param structure: Tables and their fields, updated in place.
+        :param references: Table referenced by each table, updated in place.
+        :param paths: Table of each element path, updated in place. It holds one entry by record, so None skips it
+        when only the tables are needed.
+        :param start_node: Tag of the records, which receive an internal_id.
+        :param counts: Number of elements by table name, updated in place when given.
+        """
+        self.structure = structure
+        self.references = references
+        self.paths = paths
+        self.start_node = start_node
+        self.counts = counts
+        self.__names = {}
+        self.__fields = {}
+        self.__root = None
+        self.__root_tag = None
+        self.__root_fields = {}
+        self.__root_tag_fields = {}
+        self.__root_entity = False
+        self.__root_text = None
+        # tabelas cuja referência depende de a raiz ser ou não uma tabela, o que só é conhecido no final
+        self.__unresolved = set()
+        # o índice [1] do primeiro filho da raiz só é conhecido quando aparece outro filho com a mesma tag
+        self.__child_tags = Counter()
+        self.__first_paths = {}
+        self.__current_paths = None
 
-# Gera a estrutura de tabelas correpondentes seguindo a lógica de banco de dados relacional
-def generate_structure(element: etree.ElementTree, structure: dict, references: dict, paths: dict, step=0,
-                       start_node=None):
-    if element.getroottree().getelementpath(element) == '.':
-        name = format_name(element.tag)
-    else:
-        name = format_name(element.getroottree().getelementpath(element))
-    if start_node == element.tag:
-        structure[name] = {'internal_id': {'type': 'BIGINT', 'origin': 'internal'}}
-    # atributos da tabela como conteúdo da tag
-    if element.text is not None:
-        lock.acquire()
-        if name not in structure:
-            structure[name] = {}
-        structure[name][format_name(element.tag)] = {'type': 'TEXT', 'origin': 'text'}
-        lock.release()
-    # atributos da tabela como atributos da tag
-    for attrib in element.attrib:
-        lock.acquire()
-        if name not in structure:
-            structure[name] = {}
-        structure[name][format_name(attrib)] = {'type': 'TEXT', 'origin': 'attrib'}
-        lock.release()
-    # verificando se existem tags que podem ser inseridas como atributos da estrutura
-    for child_element in element:
-        if len(child_element) == 0 and len(child_element.attrib) == 0:
-            if name not in structure:
-                lock.acquire()
-                structure[name] = {}
-                lock.release()
-    # montando referências
-    if name in structure and name not in references:
-        reference = element.getparent()
-        while reference is not None:
-            if element.getroottree().getelementpath(reference) == '.':
-                referenced_name = format_name(reference.tag)
+    def start(self, root: etree.ElementTree):
+        """Start a document. Only the tag and the attributes of the root are used."""
+        self.__root = format_name(root.tag)
+        self.__root_tag = root.tag
+        if root.tag == self.start_node:
+            self.__root_fields['internal_id'] = {'type': 'BIGINT', 'origin': 'internal'}
+        for attrib in root.attrib:
+            self.__root_fields[format_name(attrib)] = {'type': 'TEXT', 'origin': 'attrib'}
+        self.__root_entity = len(self.__root_fields) > 0
+
+    def child(self, element: etree.ElementTree):
+        """Process a complete child of the root element."""
+        if self.__root_text is None and element.getparent() is not None and element.getparent().text is not None:
+            self.__root_text = element.getparent().text
+            self.__root_entity = True
+        self.__child_tags[element.tag] += 1
+        position = self.__child_tags[element.tag]
+        if self.counts is not None:
+            self.counts[self.__name((element.tag,))] += 1
+        if position == 2 and self.paths is not None:
+            # renomeando os paths do primeiro elemento com esta tag
+            for element_path in self.__first_paths.pop(element.tag, []):
+                self.paths[f'{element.tag}[1]{element_path[len(element.tag):]}'] = self.paths.pop(element_path)
+        if len(element) == 0 and len(element.attrib) == 0:
+            # campos da raiz, que passa a ser uma tabela
+            self.__root_entity = True
+            try:
+                field = format_name(element.tag)
+            except Exception as err:
+                print(err, 'Failed to extract element structure.', 'Parent:', '.', 'Child:', element, flush=True)
+                return
+            if element.text is None:
+                self.__root_tag_fields.setdefault(field, {'type': 'TEXT', 'origin': 'tag_empty', 'tag': element.tag})
             else:
-                referenced_name = format_name(element.getroottree().getelementpath(reference))
-            if referenced_name in structure:
-                lock.acquire()
-                references[name] = referenced_name
-                lock.release()
-                break
-            reference = reference.getparent()
-    # incluindo path
-    if name in structure:
-        lock.acquire()
-        paths[element.getroottree().getelementpath(element)] = name
-        lock.release()
-    # percorrendo aninhamentos utilizando recursão
-    with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
-        for child_element in element:
-            if name not in structure or len(child_element) > 0 or len(child_element.attrib) > 0:
-                # only firts node childs are processing in thread mode
-                if start_node == element.tag:
-                    executor.submit(generate_structure,
-                                    *(child_element, structure, references, paths, step+1, start_node))
+                self.__root_tag_fields[field] = {'type': 'TEXT', 'origin': 'tag', 'tag': element.tag}
+            return
+        if position == 1:
+            self.__current_paths = self.__first_paths.setdefault(element.tag, [])
+            self.__visit(element, (element.tag,), element.tag)
+            self.__current_paths = None
+        else:
+            self.__visit(element, (element.tag,), f'{element.tag}[{position}]')
+
+    def end(self, root: etree.ElementTree):
+        """Finish a document."""
+        if self.__root_text is None and root.text is not None:
+            self.__root_text = root.text
+            self.__root_entity = True
+        if self.__root_entity:
+            fields = {}
+            if 'internal_id' in self.__root_fields:
+                fields['internal_id'] = self.__root_fields['internal_id']
+            if self.__root_text is not None:
+                fields[format_name(self.__root_tag)] = {'type': 'TEXT', 'origin': 'text'}
+            for field, value in self.__root_fields.items():
+                if field != 'internal_id':
+                    fields[field] = value
+            for field, value in self.__root_tag_fields.items():
+                if value['origin'] != 'tag_empty' or field not in fields:
+                    fields[field] = value
+            self.structure[self.__root] = fields
+            if self.paths is not None:
+                self.paths['.'] = self.__root
+            for name in self.__unresolved:
+                self.references[name] = self.__root
+        self.__first_paths = {}
+
+    def __name(self, tags):
+        if tags not in self.__names:
+            self.__names[tags] = format_name('/'.join(tags))
+        return self.__names[tags]
+
+    def __field(self, tag):
+        if tag not in self.__fields:
+            self.__fields[tag] = format_name(tag)
+        return self.__fields[tag]
+
+    def __visit(self, element, tags, element_path):
+        structure = self.structure
+        name = self.__name(tags)
+        if self.start_node == element.tag:
+            structure[name] = {'internal_id': {'type': 'BIGINT', 'origin': 'internal'}}
+        # atributos da tabela como conteúdo da tag
+        if element.text is not None:
+            structure.setdefault(name, {})[self.__field(element.tag)] = {'type': 'TEXT', 'origin': 'text'}
+        # atributos da tabela como atributos da tag
+        for attrib in element.attrib:
+            structure.setdefault(name, {})[self.__field(attrib)] = {'type': 'TEXT', 'origin': 'attrib'}
+        # verificando se existem tags que podem ser inseridas como atributos da estrutura
+        if name not in structure:
+            for child_element in element:
+                if len(child_element) == 0 and len(child_element.attrib) == 0:
+                    structure[name] = {}
+                    break
+        entity = name in structure
+        if entity:
+            # montando referências com a tabela mais próxima entre os ancestrais
+            if name not in self.references:
+                for i in range(len(tags) - 1, 0, -1):
+                    if self.__name(tags[:i]) in structure:
+                        self.references[name] = self.__name(tags[:i])
+                        break
                 else:
-                    generate_structure(child_element, structure, references, paths, step+1, start_node)
-            elif child_element.text is None:
-                try:
-                    child_element_name = format_name(child_element.tag)
-                except Exception as err:
-                    print(err, 'Failed to extract element structure.', 'Parent:',
-                          element.getroottree().getelementpath(element), 'Child:', child_element, flush=True)
-                    child_element_name = None
-                if child_element_name is not None:
-                    if child_element_name not in structure[name]:
-                        lock.acquire()
-                        structure[name][child_element_name] = {
-                            'type': 'TEXT', 'origin': 'tag_empty', 'tag': child_element.tag}
-                        lock.release()
+                    if self.__root_entity:
+                        self.references[name] = self.__root
+                    else:
+                        self.__unresolved.add(name)
+            if self.paths is not None:
+                self.paths[element_path] = name
+                if self.__current_paths is not None:
+                    self.__current_paths.append(element_path)
+        # percorrendo aninhamentos
+        repeated_tags = None
+        if len(element) > 1:
+            repeated_tags = {}
+            for child_element in element:
+                repeated_tags[child_element.tag] = repeated_tags.get(child_element.tag, 0) + 1
+        positions = {}
+        for child_element in element:
+            child_tags = tags + (child_element.tag,)
+            positions[child_element.tag] = positions.get(child_element.tag, 0) + 1
+            if self.counts is not None:
+                self.counts[self.__name(child_tags)] += 1
+            if not entity or len(child_element) > 0 or len(child_element.attrib) > 0:
+                child_path = f'{element_path}/{child_element.tag}'
+                if repeated_tags is not None and repeated_tags[child_element.tag] > 1:
+                    child_path += f'[{positions[child_element.tag]}]'
+                self.__visit(child_element, child_tags, child_path)
             else:
-                lock.acquire()
                 try:
-                    structure[name][format_name(child_element.tag)] = {
-                        'type': 'TEXT', 'origin': 'tag', 'tag': child_element.tag}
+                    field = self.__field(child_element.tag)
                 except Exception as err:
-                    print(err, 'Failed to extract element structure.', 'Parent:',
-                          element.getroottree().getelementpath(element), 'Child:', child_element, flush=True)
-                lock.release()
+                    print(err, 'Failed to extract element structure.', 'Parent:', element_path, 'Child:',
+                          child_element, flush=True)
+                    continue
+                if child_element.text is None:
+                    if field not in structure[name]:
+                        structure[name][field] = {'type': 'TEXT', 'origin': 'tag_empty', 'tag': child_element.tag}
+                else:
+                    structure[name][field] = {'type': 'TEXT', 'origin': 'tag', 'tag': child_element.tag}
+
+
+# Gera a estrutura de tabelas correpondentes seguindo a lógica de banco de dados relacional
+def generate_structure(element: etree.ElementTree, structure: dict, references: dict, paths: dict, step=0,
+                       start_node=None, counts: Counter = None):
+    inference = StructureInference(structure, references, paths, start_node=start_node, counts=counts)
+    inference.start(element)
+    for child_element in element:
+        inference.child(child_element)
+    inference.end(element)
+
+
+# Gera a estrutura lendo o arquivo com iterparse, mantendo em memória apenas um filho da raiz por vez
+def generate_structure_from_file(xml_file, structure: dict, references: dict, paths: dict, start_node=None,
+                                 counts: Counter = None) -> str:
+    root_tag = None
+    inference = StructureInference(structure, references, paths, start_node=start_node, counts=counts)
+    depth = 0
+    for event, element in etree.iterparse(xml_file, events=('start', 'end'), remove_blank_text=True,
+                                          remove_comments=True):
+        if event == 'start':
+            if depth == 0:
+                root_tag = element.tag
+                inference.start(element)
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                inference.child(element)
+                # descartando os registros já processados
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif depth == 0:
+                inference.end(element)
+    return root_tag
+
+
+# Lê os filhos da raiz (registros) em blocos com iterparse; cada bloco é descartado depois de processado
+def iterate_records(xml_file, size=1000):
+    records = []
+    root = None
+    depth = 0
+    for event, element in etree.iterparse(xml_file, events=('start', 'end'), remove_blank_text=True,
+                                          remove_comments=True):
+        if event == 'start':
+            if depth == 0:
+                root = element
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                records.append(element)
+                if len(records) >= size:
+                    yield records
+                    # o último registro continua na árvore, que o iterparse ainda está construindo
+                    for record in records:
+                        record.clear()
+                    while element.getprevious() is not None:
+                        del root[0]
+                    records = []
+    if len(records) > 0:
+        yield records
+
+
+# Conta os elementos de cada tabela em um bloco de registros, para a reserva de faixas de internal_id
+def count_records(records) -> Counter:
+    counts = Counter()
+    names = {}
+    stack = [((record.tag,), record) for record in records]
+    while len(stack) > 0:
+        tags, element = stack.pop()
+        if tags not in names:
+            names[tags] = format_name('/'.join(tags))
+        counts[names[tags]] += 1
+        stack.extend((tags + (child_element.tag,), child_element) for child_element in element)
+    return counts
+
+
+# Lista os arquivos de páginas (shards) gerados por SRA.search, em ordem de offset
+def list_shards(directory: str) -> list:
+    return sorted(glob(path.join(directory, 'page_*.xml*')))
@@ -42,7 +42,11 @@ if __name__ == "__main__":
             if pair_field[0] in tables[table]['columns'] and pair_field[1] in tables[table]['columns']:
                 database.insert_table_pair_fields(table, pair_field[0], pair_field[1])
 
-    database.detect_data(cache=True)
+    logging.info('Criando índices...')
+    database.create_indexes()
+
+    with database.index_usage_report('detect_data'):
+        database.detect_data(cache=True)
 
     logging.info('Cheching for records numbers...')
     tabelas = {
@@ -78,16 +82,23 @@ if __name__ == "__main__":
     database.create_ignored_fields_tables()
 
     logging.info('Procurando sinônimos em campos tag/value...')
-    results = database.get_counts_data(fields=[{'tag': 'value'}], cache=True)
+    with database.index_usage_report('get_counts_data'):
+        results = database.get_counts_data(fields=[{'tag': 'value'}], cache=True)
     database.get_counts_file(results=results, output_dir=output_diretory)
 
     logging.info('Completando dados consolidados...')
-    database.add_all_to_consolidated_mesh_terms_table()
+    with database.index_usage_report('add_all_to_consolidated_mesh_terms_table'):
+        database.add_all_to_consolidated_mesh_terms_table()
     logging.info('Preparando tabela com termos MeSH...')
-    database.create_sample_mining_terms_table()
+    with database.index_usage_report('create_sample_mining_terms_table'):
+        database.create_sample_mining_terms_table()
     logging.info('Criando consolidado + termos MeSH para todas as amostras...')
-    database.create_consolidated_mesh_terms_table()
+    with database.index_usage_report('create_consolidated_mesh_terms_table'):
+        database.create_consolidated_mesh_terms_table()
     logging.info('Criando consolidado de tabelas especiais...')
-    database.create_special_consolidate_sample()
+    with database.index_usage_report('create_special_consolidate_sample'):
+        database.create_special_consolidate_sample()
+    # tabelas consolidadas são indexadas por accession para a navegação
+    database.create_indexes()
 
     logging.info('Processo finalizado.')
@@ -3,19 +3,62 @@
 if __name__ == "__main__":
     import getpass
     from data.database import Database
+    from data.cache import ResponseCache
     from data.sra import SRA
     from argparse import ArgumentParser
 
     parser = ArgumentParser()
+    parser.add_argument('--api_key', default=None,
+                        help='NCBI API key. Raises the request limit from 3 to 10 requests by second.')
+    parser.add_argument('--batch_size', default=400, type=int, help='Records retrieved by request.')
+    parser.add_argument('--cache_directory', default=None, help='Keep E-utilities responses in this directory.')
+    parser.add_argument('--cache_max_size', default=None, type=float, help='Maximum cache size in megabytes.')
+    parser.add_argument('--cache_ttl', default=None, type=float, help='Cached responses time to live in hours.')
+    parser.add_argument('--checkpoint_directory', default=None,
+                        help='Keep each retrieved page in this directory and resume interrupted downloads from it.')
     parser.add_argument('--database', required=True)
+    parser.add_argument('--database_file', default='database.xml',
+                        help='Downloaded XML file. Use the .gz or .zst extension to keep it compressed.')
+    parser.add_argument('--datetype', default='mdat', choices=['mdat', 'pdat'],
+                        help='Date used by --mindate and --maxdate: modification (mdat) or publication (pdat).')
     parser.add_argument('--host', default='localhost')
+    parser.add_argument('--maxdate', default=None, help='Upper limit of --datetype (YYYY/MM/DD). Default is today.')
+    parser.add_argument('--mindate', default=None,
+                        help='With --refresh, also retrieve again the records with --datetype since this date '
+                             '(YYYY/MM/DD), replacing them in the database.')
+    parser.add_argument('--offline', action='store_true', default=False,
+                        help='Answer every E-utilities request from the cache directory.')
     parser.add_argument('--password', action='store_true')
     parser.add_argument('--port', default=None)
     parser.add_argument('--query', required=True)
     parser.add_argument('--query_public', action='store_true', default=True)
+    parser.add_argument('--refresh', action='store_true', default=False,
+                        help='Retrieve only the records not in the database yet (and the ones updated since '
+                             '--mindate) and insert them in the existing tables.')
+    parser.add_argument('--shards', default=None, choices=['xml', 'gz', 'zst'],
+                        help='Keep each page in --checkpoint_directory as a shard of this format, with an index of '
+                             'accessions by shard (index.csv), and insert the shards in parallel instead of joining '
+                             'them into --database_file.')
+    parser.add_argument('--use_history', action='store_true', default=False,
+                        help='Keep the search on the Entrez history server and fetch records by WebEnv/query_key.')
     parser.add_argument('--user', default=None)
+    parser.add_argument('--workers', default=None, type=int,
+                        help='Processes inserting records into the database, each one with its own connection. '
+                             'Default is the number of CPUs.')
     arguments = parser.parse_args()
 
+    cache = None
+    if arguments.cache_directory is not None:
+        cache = ResponseCache(
+            arguments.cache_directory,
+            ttl=arguments.cache_ttl * 3600 if arguments.cache_ttl is not None else None,
+            max_size=int(arguments.cache_max_size * 1024 * 1024) if arguments.cache_max_size is not None else None,
+            offline=arguments.offline,
+        )
+    elif arguments.offline:
+        parser.error('--offline requires --cache_directory.')
+    if arguments.shards is not None and arguments.checkpoint_directory is None:
+        parser.error('--shards requires --checkpoint_directory.')
     password = getpass.getpass('Database password: ') if arguments.password else None
     database = Database(
         database=arguments.database,
@@ -24,7 +67,23 @@ if __name__ == "__main__":
         password=password,
         port=arguments.port
     )
-    SRA().search(arguments.query, only_public=arguments.query_public)
-    database.create_from_xml('database.xml', create_structure=True)
+    sra = SRA(api_key=arguments.api_key, use_history=arguments.use_history, pagination=arguments.batch_size,
+              cache=cache)
+    refresh = dict(known_accessions=database.get_experiment_accessions(), mindate=arguments.mindate,
+                   maxdate=arguments.maxdate, datetype=arguments.datetype) if arguments.refresh else {}
+    if arguments.shards is not None:
+        updated_accessions = sra.search(arguments.query, only_public=arguments.query_public, database_file=None,
+                                        checkpoint_directory=arguments.checkpoint_directory,
+                                        compression=None if arguments.shards == 'xml' else arguments.shards,
+                                        **refresh)
+        xml = arguments.checkpoint_directory
+    else:
+        updated_accessions = sra.search(arguments.query, only_public=arguments.query_public,
+                                        database_file=arguments.database_file,
+                                        checkpoint_directory=arguments.checkpoint_directory, **refresh)
+        xml = arguments.database_file
+    if updated_accessions:
+        database.delete_experiment_packages(updated_accessions)
+    database.create_from_xml(xml, create_structure=True, workers=arguments.workers)
     print('Finished.', flush=True)
 